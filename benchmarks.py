@@ -0,0 +1,114 @@
+import datetime
+import random
+import time
+import tracemalloc
+
+from order import Order
+
+
+class LegacyOrder:
+    # The dict based layout Order used before item counts moved into an array
+    def __init__(self, order_number, food_items, drink_items, bar_items, creation_time):
+        self.order_number = order_number
+        self.creation_time = creation_time
+        self.food_items = food_items
+        self.bar_items = bar_items
+        self.drink_items = drink_items
+        self.combined_order_items = self.food_items | self.drink_items | self.bar_items
+        self.customer_name = None
+        self.total_cost = 0
+        self.status = "picked up"
+        self.card_or_cash = "card"
+        self.dirty = False
+        self.sheet_row = None
+
+
+def random_items(rng, menu, max_items):
+    return {item: rng.randint(1, 3) for item in rng.sample(list(menu), rng.randint(0, max_items))}
+
+
+def measure_memory(build):
+    tracemalloc.start()
+    start = time.perf_counter()
+    orders = build()
+    seconds = time.perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return len(orders), size, seconds
+
+
+def benchmark_order_memory(order_count=100_000):
+    rng = random.Random(0)
+    creation_time = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    categories = Order.menu.categories
+    items = [(random_items(rng, categories["food"], 3), random_items(rng, categories["drink"], 2),
+              random_items(rng, categories["bar"], 2)) for _ in range(order_count)]
+
+    def build_legacy():
+        return [LegacyOrder(number, dict(food), dict(drink), dict(bar), creation_time)
+                for number, (food, drink, bar) in enumerate(items, 1)]
+
+    def build_compact():
+        return [Order(order_number=number, food_items=food, drink_items=drink, bar_items=bar,
+                      creation_time=creation_time, status="picked up")
+                for number, (food, drink, bar) in enumerate(items, 1)]
+
+    print(f"Order memory, {order_count} orders:")
+    results = {}
+    for name, build in (("dict layout", build_legacy), ("slots + array", build_compact)):
+        count, size, seconds = measure_memory(build)
+        results[name] = size
+        print(f"  {name:14} {size / 2**20:8.1f} MiB  {size / count:6.0f} B/order  built in {seconds:.2f} s")
+    print(f"  saved {1 - results['slots + array'] / results['dict layout']:.0%}")
+
+
+def legacy_image_to_bytes(image):
+    # The per-pixel encoder printer.image_to_bytes used before pack_raster, kept as the reference output
+    image = image.convert('1')
+
+    width, height = image.size
+    image_data = []
+
+    for y in range(height):
+        row = []
+        for x in range(0, width, 8):
+            byte = 0
+            for bit in range(8):
+                if x + bit < width and image.getpixel((x + bit, y)) == 0:
+                    byte |= 128 >> bit
+            row.append(byte)
+        image_data.append(bytes(row))
+
+    return width, height, b"".join(image_data)
+
+
+def benchmark_raster_encoder():
+    # Needs Pillow and pyusb, the order benchmark above runs without them
+    from PIL import Image
+    from printer import pack_raster
+
+    rng = random.Random(0)
+    # 400x2800 is the stretched order number, the odd widths exercise the row padding
+    sizes = ((400, 2800), (397, 120), (385, 64), (8, 8), (1, 5))
+    print("Raster encoder:")
+    for width, height in sizes:
+        pixels = bytes(rng.getrandbits(8) for _ in range(((width + 7) // 8) * height))
+        image = Image.frombytes('1', (width, height), pixels)
+
+        start = time.perf_counter()
+        expected = legacy_image_to_bytes(image)
+        legacy_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        packed = pack_raster(image)
+        seconds = time.perf_counter() - start
+
+        if packed != expected:
+            raise AssertionError(f"pack_raster output differs from the legacy encoder for a {width}x{height} image")
+        print(f"  {width:4}x{height:<5} legacy {legacy_seconds * 1000:9.1f} ms  packed {seconds * 1000:7.2f} ms  "
+              f"identical")
+
+
+if __name__ == "__main__":
+    benchmark_order_memory()
+    benchmark_raster_encoder()
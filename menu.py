@@ -0,0 +1,91 @@
+import json
+import os
+import threading
+
+MENU_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "menu.json")
+CATEGORIES = ("food", "drink", "bar")
+CATEGORY_INDEX = {category: index for index, category in enumerate(CATEGORIES)}
+
+
+class MenuCatalog:
+    # menu.json with every lookup precomputed. Item ids stay fixed for the process,
+    # so a reload never touches the count arrays of existing orders.
+
+    def __init__(self, path=MENU_PATH):
+        self.path = path
+        self.mtime = None
+        self.lock = threading.Lock()  # The history loader thread registers off-menu names too
+        self.version = 0  # Bumped by every successful reload
+        self.item_names = []
+        self.item_ids = {}
+        self.item_category = {}
+        self.categories = {category: {} for category in CATEGORIES}
+        self.items = {}
+        self.item_by_key = {}
+        self.item_price = {}
+        self.category_item_ids = {category: [] for category in CATEGORIES}
+        self.reload()
+
+    def reload(self):
+        # Everything is built and checked in locals first, a broken file leaves the catalog untouched
+        try:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, encoding="utf-8") as f:
+                menu = json.load(f)
+            categories = {category: dict(menu.get(category, {})) for category in CATEGORIES}
+
+            item_by_key = {}
+            item_price = {}
+            for category, items in categories.items():
+                for item, details in items.items():
+                    key, price = details["key"], details["price"]
+                    if not isinstance(key, str) or isinstance(price, bool) or not isinstance(price, (int, float)):
+                        raise ValueError(f"{item} needs a string key and a numeric price")
+                    if key in item_by_key:
+                        print(f"Menu key '{key}' is used by both {item_by_key[key]} and {item}")
+                    item_by_key[key] = item
+                    item_price[item] = price
+        except (OSError, ValueError, TypeError, KeyError, AttributeError) as e:
+            # Keep serving the old menu while the file is missing or half edited
+            print(f"Could not load menu from {self.path}: {e}")
+            return False
+
+        for category, items in categories.items():
+            for item in items:
+                self.get_item_id(item, category)
+                self.item_category[item] = category
+
+        self.mtime = mtime
+        self.categories = categories
+        self.items = {item: details for items in categories.values() for item, details in items.items()}
+        self.item_by_key = item_by_key
+        self.item_price = item_price
+        self.rebuild_category_ids()
+        self.version += 1
+        return True
+
+    def check_for_changes(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        return mtime != self.mtime and self.reload()
+
+    def get_item_id(self, item, category="food"):
+        # Names that are not on the menu (e.g. from an old workbook) are registered on first use
+        with self.lock:
+            if item not in self.item_ids:
+                self.item_ids[item] = len(self.item_names)
+                self.item_names.append(item)
+                self.item_category[item] = category
+                self.category_item_ids[category].append(self.item_ids[item])
+            return self.item_ids[item]
+
+    def rebuild_category_ids(self):
+        # Menu items first in menu order, then names that are only known from old orders
+        category_item_ids = {category: [self.item_ids[item] for item in items]
+                             for category, items in self.categories.items()}
+        for item, item_id in self.item_ids.items():
+            if item not in self.items:
+                category_item_ids[self.item_category[item]].append(item_id)
+        self.category_item_ids = category_item_ids
@@ -0,0 +1,186 @@
+import datetime
+from array import array
+
+from menu import MenuCatalog, CATEGORIES, CATEGORY_INDEX
+
+
+class Order:
+    order_counter = 1
+    time_format = '%Y-%m-%d %H:%M:%S'
+    # Prices, keys and the stable item ids, hot reloaded from menu.json
+    menu = MenuCatalog()
+
+    __slots__ = ("order_number", "creation_time", "item_counts", "category_totals", "customer_name",
+                 "totals_version", "total_cost", "status", "card_or_cash", "dirty", "sheet_row")
+
+    def __init__(self, order_number=None, food_items=None, drink_items=None,
+                 bar_items=None, customer_name=None, creation_time=None,
+                 total_cost=0, status="active", card_or_cash="card"):
+        if order_number:
+            self.order_number = order_number
+            # Orders can be loaded out of number order, never move the counter back.
+            # The history loader thread builds orders too, it only ever takes this
+            # branch after the counter was already moved past every stored number.
+            if order_number >= Order.order_counter:
+                Order.order_counter = order_number + 1
+        else:
+            self.order_number = Order.order_counter
+            Order.order_counter += 1
+
+        self.creation_time = creation_time if creation_time else datetime.datetime.now()
+        self.item_counts = array('H', bytes(2 * len(Order.menu.item_names)))
+        # Running item value per category, kept in step by add_item/remove_item
+        # and recomputed at the new prices after a menu reload
+        self.category_totals = array('d', bytes(8 * len(CATEGORIES)))
+        self.totals_version = Order.menu.version
+        for category, items in (("food", food_items), ("drink", drink_items), ("bar", bar_items)):
+            if items:
+                for item, count in items.items():
+                    item_id = Order.menu.item_ids.get(item)
+                    if item_id is None:
+                        item_id = Order.menu.get_item_id(item, category)
+                    self.set_count(item_id, count)
+                    self.add_to_totals(item, count)
+        self.customer_name = customer_name
+        self.total_cost = total_cost
+        self.status = status
+        self.card_or_cash = card_or_cash
+
+        # Excel export bookkeeping: unsaved changes and the worksheet row once written
+        self.dirty = True
+        self.sheet_row = None
+
+    def get_count(self, item_id):
+        return self.item_counts[item_id] if item_id < len(self.item_counts) else 0
+
+    def set_count(self, item_id, count):
+        try:
+            self.item_counts[item_id] = count
+        except IndexError:
+            self.item_counts.extend([0] * (item_id + 1 - len(self.item_counts)))
+            self.item_counts[item_id] = count
+
+    def add_to_totals(self, item, count):
+        price = Order.menu.item_price.get(item) or 0
+        self.category_totals[CATEGORY_INDEX[Order.menu.item_category[item]]] += price * count
+
+    def refresh_totals(self):
+        if self.totals_version == Order.menu.version:
+            return
+        totals = array('d', bytes(8 * len(CATEGORIES)))
+        for item_id, count in enumerate(self.item_counts):
+            if count:
+                item = Order.menu.item_names[item_id]
+                price = Order.menu.item_price.get(item) or 0
+                totals[CATEGORY_INDEX[Order.menu.item_category[item]]] += price * count
+        self.category_totals = totals
+        self.totals_version = Order.menu.version
+
+    @property
+    def items_total(self):
+        self.refresh_totals()
+        return sum(self.category_totals)
+
+    def category_total(self, category):
+        self.refresh_totals()
+        return self.category_totals[CATEGORY_INDEX[category]]
+
+    def items_in_category(self, category):
+        counts = self.item_counts
+        item_names = Order.menu.item_names
+        return {item_names[item_id]: counts[item_id]
+                for item_id in Order.menu.category_item_ids[category] if item_id < len(counts) and counts[item_id]}
+
+    @property
+    def food_items(self):
+        return self.items_in_category("food")
+
+    @property
+    def drink_items(self):
+        return self.items_in_category("drink")
+
+    @property
+    def bar_items(self):
+        return self.items_in_category("bar")
+
+    @property
+    def combined_order_items(self):
+        item_names = Order.menu.item_names
+        return {item_names[item_id]: count for item_id, count in enumerate(self.item_counts) if count}
+
+    def to_record(self):
+        return {
+            "order_number": self.order_number,
+            "creation_time": self.creation_time.strftime(Order.time_format),
+            "customer_name": self.customer_name,
+            "food_items": self.food_items,
+            "drink_items": self.drink_items,
+            "bar_items": self.bar_items,
+            "total_cost": self.total_cost,
+            "status": self.status,
+            "card_or_cash": self.card_or_cash,
+        }
+
+    @classmethod
+    def from_record(cls, record):
+        creation_time = record["creation_time"]
+        if isinstance(creation_time, str):
+            creation_time = datetime.datetime.strptime(creation_time, Order.time_format)
+        return cls(
+            order_number=record["order_number"],
+            food_items=record["food_items"],
+            drink_items=record["drink_items"],
+            bar_items=record["bar_items"],
+            customer_name=record["customer_name"],
+            creation_time=creation_time,
+            total_cost=record["total_cost"],
+            status=record["status"],
+            card_or_cash=record["card_or_cash"]
+        )
+
+    @classmethod
+    def get_item_price(cls, item_name):
+        return cls.menu.item_price.get(item_name)
+
+    @classmethod
+    def get_item_key(cls, item_name):
+        if item_name in cls.menu.items:
+            return cls.menu.items[item_name]["key"]
+
+    @classmethod
+    def get_item_by_key(cls, key):
+        return cls.menu.item_by_key.get(key)
+
+    @classmethod
+    def calculate_total_price(cls, order):
+        return order.items_total
+
+    @classmethod
+    def get_items_display(cls, order):
+        return "Current Order: " + ", ".join(f"{item} x{count}" for item, count in order.combined_order_items.items())
+
+    @classmethod
+    def add_item(cls, item, order):
+        if item in Order.menu.items:
+            item_id = Order.menu.item_ids[item]
+            order.refresh_totals()
+            order.set_count(item_id, order.get_count(item_id) + 1)
+            order.add_to_totals(item, 1)
+        order.dirty = True
+        return order
+
+    @classmethod
+    def remove_item(cls, item, order):
+        if item in Order.menu.items:
+            item_id = Order.menu.item_ids[item]
+            if order.get_count(item_id) > 0:
+                order.refresh_totals()
+                order.set_count(item_id, order.get_count(item_id) - 1)
+                order.add_to_totals(item, -1)
+        order.dirty = True
+
+    @classmethod
+    def get_prompt_text(cls):
+        category_texts = [", ".join(f"'{details['key']}' {item}" for item, details in items.items())
+                          for items in cls.menu.categories.values()]
+        return '\n'.join(category_texts) + '\nEnter: finish order'
@@ -1,3 +1,8 @@
+import os
+import threading
+import zlib
+from collections import OrderedDict
+from functools import lru_cache
 import usb.core
 import usb.util
 from PIL import Image, ImageDraw, ImageFont
@@ -8,74 +13,139 @@ font = 'digital-7.mono.ttf'
 font2 = 'FiraCode-Bold.ttf'
 font3 = 'BebasNeue-Regular.ttf'
 
+RASTER_CACHE_DIR = "raster_cache"  # Rendered order numbers kept across restarts, None keeps them in memory only
 
-def create_large_number_image(number, output_path, font_path=path+font2,
-                              font_size=220 * x):
+
+@lru_cache(maxsize=None)
+def load_font(font_path, font_size):
+    return ImageFont.truetype(font_path, font_size)
+
+
+def render_number_image(number, font_path=path+font2, font_size=220 * x):
     # Create an image with white background
     width, height = 400 * x, 400 * x  # Adjust size as needed
     image = Image.new('1', (width, height), color=1)  # 1-bit pixels, black and white
     draw = ImageDraw.Draw(image)
 
-    # Load font
-    font = ImageFont.truetype(font_path, font_size)
-
-    # Calculate text size and position using textbbox
     position = (-10 * x, -50 * x)
+    draw.text(position, number, fill=0, font=load_font(font_path, font_size))
+    return image
 
-    # Draw text
-    draw.text(position, number, fill=0, font=font)
-
-    # Save image
-    image.save(output_path)
 
-
-def stretch_image_vertically(input_path, output_path, stretch_factor=3):
-    # Open the image
-    image = Image.open(input_path)
-
-    # Get the current size
+def stretch_image(image, stretch_factor=3):
     width, height = image.size
+    return image.resize((width, int(height * stretch_factor)), Image.Resampling.LANCZOS)
 
-    # Calculate the new height
-    new_height = int(height * stretch_factor)
 
-    # Resize the image
-    stretched_image = image.resize((width, new_height), Image.Resampling.LANCZOS)
+# Pillow packs mode '1' rows MSB first with white as 1, ESC/POS raster wants black as 1
+INVERT_TABLE = bytes(255 - value for value in range(256))
 
-    # Save the stretched image
-    stretched_image.save(output_path)
 
-
-def image_to_bytes(image_path):
-    image = Image.open(image_path)
+def pack_raster(image):
+    # Whole-buffer GS v 0 packing, no per-pixel Python
     image = image.convert('1')
-
     width, height = image.size
-    image_data = []
-
-    for y in range(height):
-        row = []
-        for x in range(0, width, 8):
-            byte = 0
-            for bit in range(8):
-                if x + bit < width and image.getpixel((x + bit, y)) == 0:
-                    byte |= 128 >> bit  # Changed from 1 << bit to 128 >> bit
-            row.append(byte)
-        image_data.append(bytes(row))
-
-    return width, height, image_data
-
-
-def image_print(ep, image_path):
-    width, height, image_data = image_to_bytes(image_path)
-    # ESC * m nL nH xL xH data
-    esc = b'\x1D\x76\x30\x00'
-    size_data = bytes([width % 256, width // 256, height % 256, height // 256])
-
-    ep.write(esc + size_data)
-
-    for row in image_data:
-        ep.write(bytes(row))
+    row_bytes = (width + 7) // 8
+    data = bytearray(image.tobytes().translate(INVERT_TABLE))
+
+    # Inversion turns the padding after the last pixel of each row into black dots, clear it
+    if width % 8:
+        mask = (0xFF << (8 - width % 8)) & 0xFF
+        mask_table = bytes(value & mask for value in range(256))
+        data[row_bytes - 1::row_bytes] = data[row_bytes - 1::row_bytes].translate(mask_table)
+
+    return width, height, bytes(data)
+
+
+def raster_command(image):
+    # GS v 0 header followed by the packed rows, ready to write to the printer
+    width, height, data = pack_raster(image)
+    return b'\x1D\x76\x30\x00' + bytes([width % 256, width // 256, height % 256, height // 256]) + data
+
+
+class NumberRasterCache:
+    # Ready-to-send raster commands for the order number, zlib compressed in an LRU
+
+    def __init__(self, capacity=1000, cache_dir=RASTER_CACHE_DIR, font_path=path+font2, font_size=220 * x,
+                 stretch_factor=7):
+        self.capacity = capacity
+        self.cache_dir = cache_dir
+        self.font_path = font_path
+        self.font_size = font_size
+        self.stretch_factor = stretch_factor
+        # Files from other render settings never match
+        self.file_prefix = f"{os.path.basename(font_path)}_{font_size}_{stretch_factor}_"
+        self.blobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.render_lock = threading.Lock()
+        self.prerender_thread = None
+
+    def get(self, number):
+        return zlib.decompress(self.compressed(number))
+
+    def compressed(self, number):
+        with self.lock:
+            blob = self.blobs.get(number)
+            if blob is not None:
+                self.blobs.move_to_end(number)
+                return blob
+
+        blob = self.read_file(number)
+        if blob is None:
+            with self.render_lock:
+                image = stretch_image(render_number_image(number, self.font_path, self.font_size),
+                                      self.stretch_factor)
+                blob = zlib.compress(raster_command(image))
+            self.write_file(number, blob)
+
+        with self.lock:
+            self.blobs[number] = blob
+            if len(self.blobs) > self.capacity:
+                self.blobs.popitem(last=False)
+        return blob
+
+    def cache_path(self, number):
+        return os.path.join(self.cache_dir, f"{self.file_prefix}{number}.zlib")
+
+    def read_file(self, number):
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self.cache_path(number), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def write_file(self, number, blob):
+        if self.cache_dir is None:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp_path = self.cache_path(number) + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(blob)
+            os.replace(temp_path, self.cache_path(number))
+        except OSError as e:
+            print(f"Could not write raster cache for {number}: {e}")
+
+    def prerender(self, next_number=0):
+        if self.prerender_thread is not None and self.prerender_thread.is_alive():
+            return
+        self.prerender_thread = threading.Thread(target=self.prerender_numbers, args=(next_number % 1000,),
+                                                 daemon=True)
+        self.prerender_thread.start()
+
+    def prerender_numbers(self, start):
+        # Upcoming numbers first, then the rest of 000-999
+        for number in list(range(start, 1000)) + list(range(start)):
+            try:
+                self.compressed(str(number).zfill(3))
+            except OSError as e:
+                print(f"Stopped pre-rendering order numbers: {e}")
+                return
+
+
+number_rasters = NumberRasterCache()
 
 
 def init_printer():
@@ -107,40 +177,123 @@ def set_text_mode(ep):
     ep.write(b'\x1B\x52\x00')  # ESC R 0 - Select international character set
 
 
-def print_text(text, size=1):
-    print("hey" + text)
-    ep, dev = init_printer()
-    try:
-        set_text_mode(ep)
-        if size == 1:
-            print("Aga siin")
-            ep.write(b'\x1B\x21\x00')  # ESC ! 0
-            ep.write(text.encode() + b'\n')
-
-        elif size == 2:
-            ep.write(b'\x1B\x21\x30')  # ESC ! 48
-            ep.write(text.encode() + b'\n')
-    finally:
-        usb.util.dispose_resources(dev)
-
-
-def print_image(numb):
-    ep, dev = init_printer()
-    try:
-        create_large_number_image(numb, 'number_image.bmp')
-        stretch_image_vertically('number_image.bmp', 'stretched_number_image.bmp', stretch_factor=7)
-        image_print(ep, 'stretched_number_image.bmp')
-    finally:
-        usb.util.dispose_resources(dev)
+class PartialWriteError(Exception):
+    # Part of the buffer is already on paper, sending it again would print it twice
+    pass
+
+
+class PrinterSession:
+    # The printer connection, opened on the first write and reopened after a USB error
+
+    packets_per_transfer = 256
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.ep = None
+        self.dev = None
+
+    def connect(self):
+        self.ep, self.dev = init_printer()
+        set_text_mode(self.ep)
+
+    def disconnect(self):
+        if self.dev is not None:
+            try:
+                usb.util.dispose_resources(self.dev)
+            except usb.core.USBError:
+                pass
+        self.ep = None
+        self.dev = None
+
+    def write(self, data):
+        # Returns the number of USB transfers used
+        with self.lock:
+            for attempt in range(2):
+                sent = 0
+                try:
+                    if self.ep is None:
+                        self.connect()
+                    chunk_size = self.ep.wMaxPacketSize * self.packets_per_transfer
+                    transfers = 0
+                    while sent < len(data):
+                        sent += self.ep.write(data[sent:sent + chunk_size])
+                        transfers += 1
+                    return transfers
+                except usb.core.USBError as e:
+                    print(f"Printer USB error: {e}")
+                    self.disconnect()
+                    # Resending after part of a receipt went out would print it twice
+                    if sent:
+                        raise PartialWriteError(f"USB error after {sent} of {len(data)} bytes: {e}") from e
+                    if attempt:
+                        raise
+
+    def is_healthy(self):
+        # Connects if needed, then asks the device for its USB status
+        with self.lock:
+            try:
+                if self.dev is None:
+                    self.connect()
+                self.dev.ctrl_transfer(0x80, 0x00, 0, 0, 2, timeout=500)  # GET_STATUS
+                return True
+            except (usb.core.USBError, ValueError) as e:
+                print(f"Printer not ready: {e}")
+                self.disconnect()
+                return False
+
+    def close(self):
+        with self.lock:
+            self.disconnect()
+
+
+printer_session = PrinterSession()
+
+
+class Receipt:
+    # One receipt in a single buffer, nothing reaches the printer before send()
+
+    text_sizes = {1: b'\x1B\x21\x00', 2: b'\x1B\x21\x30'}  # ESC ! 0, ESC ! 48
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    @property
+    def data(self):
+        return bytes(self.buffer)
+
+    def raw(self, data):
+        self.buffer += data
+        return self
+
+    def text(self, text, size=1):
+        self.buffer += self.text_sizes[size] + text.encode() + b'\n'
+        return self
+
+    def feed(self, lines):
+        self.buffer += b'\n' * lines
+        return self
+
+    def image(self, image):
+        self.buffer += raster_command(image)
+        return self
+
+    def order_number(self, number):
+        self.buffer += number_rasters.get(number)
+        return self
+
+    def send(self, session=None):
+        return (session or printer_session).write(self.data)
 
 
 def print_order():
-    print_text('Sinu tellimus on:', size=2)
+    receipt = Receipt()
+    receipt.text('Sinu tellimus on:', size=2)
     for item, count in {"kana": 1, "kala": 2}.items():
-        print_text(f"{item} x{count}")
-    print_text('sinu tellimuse number:', size=2)
-    print_image(f"{str(78).zfill(3)}")
-    print_text('hei')
+        receipt.text(f"{item} x{count}")
+    receipt.text('sinu tellimuse number:', size=2)
+    receipt.order_number(f"{str(78).zfill(3)}")
+    receipt.text('hei')
+    receipt.send()
 
 
 if __name__ == "__main__":
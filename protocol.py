@@ -0,0 +1,88 @@
+import json
+import struct
+
+# Every message between the manager and the customer display is one frame:
+# a 4 byte big-endian payload length followed by the payload.
+HEADER = struct.Struct("!I")
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+
+
+def encode_frame(payload):
+    return HEADER.pack(len(payload)) + payload
+
+
+def encode_message(message):
+    return encode_frame(json.dumps(message).encode())
+
+
+class FrameDecoder:
+    """Buffers received bytes and returns the frames completed by each chunk."""
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        while len(self.buffer) >= HEADER.size:
+            (length,) = HEADER.unpack_from(self.buffer)
+            if length > MAX_FRAME_SIZE:
+                raise ValueError(f"Frame of {length} bytes exceeds the {MAX_FRAME_SIZE} byte limit")
+            if len(self.buffer) < HEADER.size + length:
+                break
+            frames.append(bytes(self.buffer[HEADER.size:HEADER.size + length]))
+            del self.buffer[:HEADER.size + length]
+        return frames
+
+
+# Order board protocol, carried as JSON frames over one long-lived connection.
+# The manager sends a full snapshot when the connection opens and deltas after
+# that, each with the next sequence number. A display that sees a gap in the
+# sequence answers with a resync request and gets a fresh snapshot.
+# Heartbeats share the connection; the display acknowledges every snapshot,
+# delta and heartbeat with the last sequence number it applied and echoes the
+# sender's "t" stamp so the manager can measure round trips.
+PROTOCOL_VERSION = 1
+
+
+def snapshot_message(seq, board):
+    return {"v": PROTOCOL_VERSION, "type": "snapshot", "seq": seq,
+            "active": sorted(number for number, status in board.items() if status == "active"),
+            "completed": sorted(number for number, status in board.items() if status == "completed")}
+
+
+def delta_message(seq, changes):
+    return {"v": PROTOCOL_VERSION, "type": "delta", "seq": seq, "changes": changes}
+
+
+def resync_message(seq):
+    return {"v": PROTOCOL_VERSION, "type": "resync", "seq": seq}
+
+
+def heartbeat_message(seq):
+    return {"v": PROTOCOL_VERSION, "type": "heartbeat", "seq": seq}
+
+
+def ack_message(seq, t):
+    return {"v": PROTOCOL_VERSION, "type": "ack", "seq": seq, "t": t}
+
+
+def board_from_snapshot(message):
+    board = {number: "active" for number in message["active"]}
+    board.update((number, "completed") for number in message["completed"])
+    return board
+
+
+def board_changes(old, new):
+    # [order number, old status or None, new status or None] for each order that moved
+    changes = [[number, old.get(number), status] for number, status in new.items() if old.get(number) != status]
+    changes.extend([number, status, None] for number, status in old.items() if number not in new)
+    return changes
+
+
+def apply_changes(board, changes):
+    for number, _, status in changes:
+        if status is None:
+            board.pop(number, None)
+        else:
+            board[number] = status
@@ -1,156 +1,170 @@
 import sys
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QInputDialog,
-                             QLineEdit, QScrollArea, QFrame, QDialog, QMessageBox, QShortcut, QSplitter, QTextEdit)
-from PyQt5.QtCore import Qt, QTimer, QSize, QThread, pyqtSignal, QObject
+                             QLineEdit, QScrollArea, QFrame, QDialog, QMessageBox, QShortcut, QSplitter, QTextEdit,
+                             QTableView, QStyledItemDelegate, QHeaderView, QAbstractItemView)
+from PyQt5.QtCore import (Qt, QTimer, QSize, QThread, pyqtSignal, QObject, QFileSystemWatcher,
+                          QAbstractTableModel, QModelIndex, QRect)
 from PyQt5.QtGui import QFont, QKeySequence, QPainter, QColor, QImage
 import datetime
+from array import array
 from openpyxl import Workbook, load_workbook
 import os
 from printer import *
+from storage import open_order_store
+from order import Order
+from protocol import (FrameDecoder, encode_message, snapshot_message, delta_message, heartbeat_message,
+                      board_changes)
 import socket
+import usb.core
 import json
 import select
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
 
+# "sqlite" or "journal", see storage.py
+STORAGE_BACKEND = "sqlite"
+PRINT_QUEUE_PATH = "print_queue.json"
+# Exists while the orders.xlsx history is not fully in the order store yet
+HISTORY_IMPORT_MARKER = "orders_import.pending"
 
-class Order:
-    order_counter = 1
-    food_items_info = {
-        "Friikad": {"price": 2, "key": "1"},
-        "Friikartulid vinkudega": {"price": 3, "key": "2"},
-        "Bataadifriikad": {"price": 3, "key": "3"},
-        "Bataadifriikad vinkudega": {"price": 4, "key": "4"},
-        "Pelmeenid": {"price": 2.5, "key": "5"},
-        "Wrap": {"price": 3, "key": "6"},
-        "Burger": {"price": 3, "key": "7"},
-        "Kokteil klassika": {"price": 2, "key": "8"},
-        "Kokteil saladus": {"price": 2, "key": "9"},
-    }
 
-    drink_items_info = {
-        "Coca-Cola": {"price": 1.5, "key": "g"},
-        "Fanta": {"price": 1.5, "key": "h"},
-        "Limpa": {"price": 1.5, "key": "j"},
-        "Vesi": {"price": 1, "key": "k"},
-    }
+class OrderRepository:
+    # Orders by number and by status, status changes have to go through reindex()
 
-    bar_items_info = {
-        "hammertime": {"price": 4, "key": "z"},
-        "akutrell": {"price": 4, "key": "x"},
-        "rohtlakiisu": {"price": 4, "key": "v"},
-        "kruvikeeraja": {"price": 4, "key": "b"},
-        "kahemehesaag": {"price": 6, "key": "n"},
-        "relakas": {"price": 2, "key": "m"},
-        "Lammutaja BirgIT": {"price": 4, "key": ","},
-        "Lendav sirel": {"price": 4, "key": "."},
-        "Tugevusõpetus": {"price": 4, "key": "/"},
-        "red bull": {"price": 2, "key": "'"},
-        "õlu": {"price": 2, "key": "]"}
-    }
+    def __init__(self):
+        self.by_number = {}
+        self.by_status = {}
+        self.filed_status = {}
 
-    combined_items_info = food_items_info | drink_items_info | bar_items_info
+    def __len__(self):
+        return len(self.by_number)
 
-    def __init__(self, order_number=None, food_items=None, drink_items=None,
-                 bar_items=None, customer_name=None, creation_time=None,
-                 total_cost=0, status="active", card_or_cash="card"):
-        if order_number:
-            self.order_number = order_number
-            Order.order_counter = order_number
-        else:
-            self.order_number = Order.order_counter
-        Order.order_counter += 1
-
-        self.creation_time = creation_time if creation_time else datetime.datetime.now()
-        self.food_items = food_items if food_items else {}
-        self.bar_items = bar_items if bar_items else {}
-        self.drink_items = drink_items if drink_items else {}
-        self.combined_order_items = self.food_items | self.drink_items | self.bar_items
-        self.customer_name = customer_name
-        self.total_cost = total_cost
-        self.status = status
-        self.card_or_cash = card_or_cash
-
-    @classmethod
-    def get_item_price(cls, item_name):
-        if item_name in cls.combined_items_info:
-            return cls.combined_items_info.get(item_name, {}).get("price", 0)
-
-    @classmethod
-    def get_item_key(cls, item_name):
-        if item_name in cls.combined_items_info:
-            return cls.combined_items_info.get(item_name, {}).get("key", "")
-
-    @classmethod
-    def get_item_by_key(cls, key):
-        for item, details in cls.combined_items_info.items():
-            if details["key"] == key:
-                return item
-        return None
+    def __iter__(self):
+        return iter(list(self.by_number.values()))
 
-    @classmethod
-    def calculate_total_price(cls, order):
-        return sum(cls.get_item_price(item) * quantity for item, quantity in order.combined_order_items.items())
+    def get(self, order_number):
+        return self.by_number.get(order_number)
 
-    @classmethod
-    def get_items_display(cls, order):
-        return "Current Order: " + ", ".join(f"{item} x{count}" for item, count in order.combined_order_items.items())
+    def add(self, order):
+        self.by_number[order.order_number] = order
+        self.reindex(order)
 
-    @classmethod
-    def add_item(cls, item, order):
-        if item in Order.food_items_info:
-            if item in order.food_items:
-                order.food_items[item] += 1
-            else:
-                order.food_items[item] = 1
+    def remove(self, order):
+        self.by_number.pop(order.order_number, None)
+        status = self.filed_status.pop(order.order_number, None)
+        if status is not None:
+            del self.by_status[status][order.order_number]
 
-        elif item in Order.bar_items_info:
-            if item in order.bar_items:
-                order.bar_items[item] += 1
-            else:
-                order.bar_items[item] = 1
+    def reindex(self, order):
+        # Returns the status the order was filed under if it changed
+        status = self.filed_status.get(order.order_number)
+        if status == order.status:
+            return None
+        if status is not None:
+            del self.by_status[status][order.order_number]
+        self.by_status.setdefault(order.status, {})[order.order_number] = order
+        self.filed_status[order.order_number] = order.status
+        return status
 
-        elif item in Order.drink_items_info:
-            if item in order.drink_items:
-                order.drink_items[item] += 1
-            else:
-                order.drink_items[item] = 1
+    def with_status(self, status):
+        orders = self.by_status.get(status, {})
+        return [orders[order_number] for order_number in sorted(orders)]
 
-        order.combined_order_items = order.food_items | order.drink_items | order.bar_items
-        return order
+    def count_with_status(self, status):
+        return len(self.by_status.get(status, {}))
 
-    @classmethod
-    def remove_item(cls, item, order):
-        if item in Order.food_items_info:
-            if item in order.food_items:
-                if order.food_items[item] > 1:
-                    order.food_items[item] -= 1
-                else:
-                    del order.food_items[item]
+    def sorted(self):
+        return [self.by_number[order_number] for order_number in sorted(self.by_number)]
 
-        elif item in Order.bar_items_info:
-            if item in order.bar_items:
-                if order.bar_items[item] > 1:
-                    order.bar_items[item] -= 1
-                else:
-                    del order.bar_items[item]
 
-        elif item in Order.drink_items_info:
-            if item in order.drink_items:
-                if order.drink_items[item] > 1:
-                    order.drink_items[item] -= 1
-                else:
-                    del order.drink_items[item]
+class RevenueLedger:
+    # Today's money per payment bucket. Each order's contribution is remembered
+    # so a change only moves that order's amount.
+
+    buckets = ("card", "cash", "free", "coupon")
+
+    def __init__(self):
+        self.day = datetime.date.today()
+        self.totals = {bucket: 0 for bucket in self.buckets}
+        self.counts = {bucket: 0 for bucket in self.buckets}
+        self.contributions = {}
+
+    def roll_over(self):
+        # Everything counted so far belongs to a day that has ended
+        today = datetime.date.today()
+        if today != self.day:
+            self.day = today
+            self.totals = {bucket: 0 for bucket in self.buckets}
+            self.counts = {bucket: 0 for bucket in self.buckets}
+            self.contributions = {}
+
+    def contribution(self, order):
+        if order.creation_time.date() != self.day:
+            return None
+        if order.total_cost in ("free", "coupon"):
+            return order.total_cost, order.items_total
+        if isinstance(order.total_cost, (int, float)):
+            return order.card_or_cash, order.total_cost
+        return None
+
+    def update(self, order):
+        self.roll_over()
+        self.remove(order)
+        contribution = self.contribution(order)
+        if contribution is not None and contribution[0] in self.totals:
+            bucket, amount = contribution
+            self.totals[bucket] += amount
+            self.counts[bucket] += 1
+            self.contributions[order.order_number] = contribution
+
+    def remove(self, order):
+        self.roll_over()
+        contribution = self.contributions.pop(order.order_number, None)
+        if contribution is not None:
+            bucket, amount = contribution
+            self.totals[bucket] -= amount
+            self.counts[bucket] -= 1
+
+    def summary(self):
+        self.roll_over()
+        return ", ".join(f"{bucket} {self.totals[bucket]:.2f}€ ({self.counts[bucket]})" for bucket in self.buckets)
+
+
+class RefreshScheduler(QObject):
+    # Runs display and persistence stages at most once per frame
+
+    def __init__(self, stages, interval=16, parent=None):
+        super().__init__(parent)
+        self.stages = stages
+        self.dirty = set()
+        self.requests = {name: 0 for name in stages}
+        self.runs = {name: 0 for name in stages}
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.run)
+
+    def mark_dirty(self, *stages):
+        for name in stages:
+            self.requests[name] += 1
+            self.dirty.add(name)
+        if not self.timer.isActive():
+            self.timer.start()
 
-        order.combined_order_items = order.food_items | order.drink_items | order.bar_items
+    def run(self):
+        dirty = self.dirty
+        self.dirty = set()
+        for name, stage in self.stages.items():
+            if name in dirty:
+                self.runs[name] += 1
+                stage()
 
-    @classmethod
-    def get_prompt_text(cls):
-        food_text = ", ".join(
-            f"'{details['key']}' {item}" for item, details in Order.food_items_info.items())
-        drink_text = ", ".join(
-            f"'{details['key']}' {item}" for item, details in Order.drink_items_info.items())
-        bar_text = ", ".join(
-            f"'{details['key']}' {item}" for item, details in Order.bar_items_info.items())
-        return food_text + '\n' + drink_text + '\n' + bar_text + '\nEnter: finish order'
+    def summary(self):
+        requested = sum(self.requests.values())
+        ran = sum(self.runs.values())
+        return f"{requested} requested, {ran} run, {requested - ran} saved"
 
 
 class KitchenManagerApp(QMainWindow):
@@ -160,27 +174,59 @@ class KitchenManagerApp(QMainWindow):
         self.setWindowTitle("Kitchen Manager")
         self.setGeometry(400, 400, 800, 800)
 
-        self.orders_list = []
+        self.orders = OrderRepository()
+        self.orders_model = OrdersTableModel(self)
+        self.revenue = RevenueLedger()
+        self.pending_row_changes = {}
+        self.dirty_orders = {}
+        self.next_sheet_row = 2
+        self.pending_sheet_changes = []
 
         self.current_order = None
         self.new_order = None
 
         self.rpi_ip = '100.118.0.128'
         self.rpi_port = 5000
+        self.rpi_completed_window = 30  # Only the newest completed orders go to the display
         self.rpi_connected = False
+        self.rpi_link = RPiLink(self.rpi_ip, self.rpi_port)
+        self.rpi_link.connection_changed.connect(self.handle_rpi_connection_changed)
+        self.rpi_link.start()
+        # Keeps the link metrics ("last ack N s ago") current while connected
+        self.rpi_info_timer = QTimer(self)
+        self.rpi_info_timer.timeout.connect(self.refresh_rpi_info)
+        self.rpi_info_timer.start(1000)
+
+        self.last_export_info = "Not exported yet"
+        self.history_loader = None
+        self.history_merge_seconds = 0
+        self.resume_workbook_import = False
+        self.excel_writer = ExcelWriterThread("orders.xlsx")
+        self.excel_writer.save_finished.connect(self.handle_excel_saved)
+        self.excel_writer.start()
 
         # Create instances of KitchenWindow and CustomerWindow
         self.kitchen_window = KitchenWindow(self)
         self.kitchen_window.show()
 
-        self.load_or_create_workbook()
+        self.refresh = RefreshScheduler({
+            "manager": self.apply_row_changes,
+            "kitchen": self.update_kitchen_display,
+            "customer": self.send_update_to_rpi,
+            "persistence": self.export_orders_to_excel,
+            "info": self.update_info_widget,
+        }, parent=self)
+
+        self.store = open_order_store(STORAGE_BACKEND)
+        self.load_orders()
+        self.print_spooler = PrintSpooler()
+        self.print_spooler.status_changed.connect(lambda: self.refresh.mark_dirty("info"))
+        self.print_spooler.start()
 
         self.init_ui()
 
-        # Start periodic connection check
-        self.connection_timer = QTimer(self)
-        self.connection_timer.timeout.connect(self.start_ping)
-        self.connection_timer.start(5000)  # Check every 5 seconds
+        self.menu_watcher = QFileSystemWatcher([Order.menu.path], self)
+        self.menu_watcher.fileChanged.connect(self.reload_menu)
 
     def init_ui(self):
         splitter = QSplitter(Qt.Horizontal)
@@ -189,6 +235,21 @@ class KitchenManagerApp(QMainWindow):
         self.main_content_widget = QWidget()
         self.main_layout = QVBoxLayout(self.main_content_widget)
 
+        self.orders_view = QTableView()
+        self.orders_view.setModel(self.orders_model)
+        self.orders_view.setItemDelegate(StatusColorDelegate(self.orders_view))
+        self.orders_view.setSelectionMode(QAbstractItemView.NoSelection)
+        self.orders_view.setFocusPolicy(Qt.NoFocus)
+        self.orders_view.verticalHeader().hide()
+        # Fixed row heights and no content-based column sizing keep painting to the visible rows
+        self.orders_view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.orders_view.verticalHeader().setDefaultSectionSize(28)
+        self.orders_view.horizontalHeader().setFont(QFont("Franklin Gothic Demi", 10, QFont.Bold))
+        self.orders_view.horizontalHeader().setStretchLastSection(True)
+        self.orders_model.rowsInserted.connect(self.scroll_to_new_orders)
+        self.orders_model.modelReset.connect(self.orders_view.scrollToBottom)
+        self.main_layout.addWidget(self.orders_view)
+
         right_panel = QWidget()
         right_layout = QVBoxLayout(right_panel)
 
@@ -220,6 +281,7 @@ class KitchenManagerApp(QMainWindow):
         QShortcut(QKeySequence('E'), self, self.edit_order_process)
         QShortcut(QKeySequence('Shift+P'), self, self.toggle_order_print)
         QShortcut(QKeySequence('P'), self, self.print_select_order)
+        QShortcut(QKeySequence('X'), self, self.export_orders_to_excel)
 
     def update_shortcuts_widget(self):
         self.shortcuts_widget.setHtml("""
@@ -232,6 +294,7 @@ class KitchenManagerApp(QMainWindow):
             <p>E: Edit Order</p>
             <p>Shift+P: Toggle Order Print</p>
             <p>P: Print Selected Order</p>
+            <p>X: Export Orders to Excel</p>
             </body>
             </html>
         """)
@@ -239,172 +302,260 @@ class KitchenManagerApp(QMainWindow):
     def new_order_process(self):
         dialog = NewOrderDialog(self)
         if dialog.exec_():
-            self.orders_list.append(dialog.new_order)
-            self.update_displays()
+            self.orders.add(dialog.new_order)
+            self.record_new_order(dialog.new_order)
+
+    def reload_menu(self, path):
+        # Editors often save by replacing the file, which drops it from the watcher
+        if path not in self.menu_watcher.files() and os.path.exists(path):
+            self.menu_watcher.addPath(path)
+        if Order.menu.check_for_changes():
+            print(f"Menu reloaded: {len(Order.menu.items)} items.")
 
     def update_order_process(self):
         dialog = UpdateOrderDialog(self)
         dialog.exec_()
-        self.update_displays()
 
     def edit_order_process(self):
         dialog = EditOrderDialog(self)
         dialog.exec_()
-        self.update_displays()
 
     def update_displays(self):
-
-        def _update_manager_display():
-            self.clear_layout(self.main_layout)
-
-            header_text = "Order # | Time | Customer Name | Food Items | Drink Items | Card or Cash | Total Price"
-            header_label = QLabel(header_text)
-            header_label.setFont(QFont("Franklin Gothic Demi", 10, QFont.Bold))
-            self.main_layout.addWidget(header_label)
-
-            scroll_area = QScrollArea()
-            scroll_area.setWidgetResizable(True)
-            scroll_widget = QWidget()
-            scroll_layout = QVBoxLayout(scroll_widget)
-
-            all_orders = sorted(self.orders_list, key=lambda order: order.order_number)
-            for order in all_orders:
-                order_frame = QFrame()
-                order_frame.setFrameStyle(QFrame.Box | QFrame.Plain)
-                order_frame.setStyleSheet(f"background-color: {get_color_for_status(order.status)};")
-
-                order_layout = QHBoxLayout(order_frame)
-
-                total_cost_display = f"{order.total_cost:.2f}€" if isinstance(order.total_cost,
-                                                                              (int, float)) else order.total_cost
-                order_info = (
-                    f"{order.order_number} | "
-                    f"{order.creation_time.strftime('%H:%M:%S')} | "
-                    f"{order.customer_name or 'N/A'} | "
-                    f"{', '.join([f'{item} x {quantity}' for item, quantity in (order.food_items | order.drink_items).items()])} | "
-                    f"{', '.join([f'{item} x {quantity}' for item, quantity in order.bar_items.items()])} | "
-                    f"{order.card_or_cash} | "
-                    f"{total_cost_display} | "
-                )
-                order_label = QLabel(order_info)
-                order_layout.addWidget(order_label)
-
-                scroll_layout.addWidget(order_frame)
-
-            scroll_area.setWidget(scroll_widget)
-            self.main_layout.addWidget(scroll_area)
-
-            QTimer.singleShot(100, lambda: scroll_area.verticalScrollBar().setValue(
-                scroll_area.verticalScrollBar().maximum()))
-
-        def get_color_for_status(status):
-            if status == "active":
-                return "red"
-            elif status == "completed":
-                return "yellow"
-            elif status == "picked up":
-                return "green"
-            elif status == "bar":
-                return "blue"
-
-        _update_manager_display()
-        self.kitchen_window.update_display([order for order in self.orders_list if order.status == "active"])
-        self.send_update_to_rpi()
-        self.save_orders_to_excel()
-
-    def load_or_create_workbook(self):
-        file_path = "orders.xlsx"
-        if os.path.exists(file_path):
-            self.workbook = load_workbook(file_path)
-            self.worksheet = self.workbook.active
-            print("Workbook loaded.")
-            self.read_orders_from_excel()
+        # Full refresh: rebuild the manager rows and run every stage on the next tick
+        self.pending_row_changes.clear()
+        self.orders_model.set_orders(self.orders.sorted())
+        self.refresh.mark_dirty(*self.refresh.stages)
+
+    def apply_row_changes(self):
+        for order in self.pending_row_changes.values():
+            self.orders_model.order_changed(order)
+        self.pending_row_changes.clear()
+
+    def update_kitchen_display(self):
+        self.kitchen_window.update_display(self.orders.with_status("active"))
+
+    def scroll_to_new_orders(self, parent, first, last):
+        if last == self.orders_model.rowCount() - 1:
+            self.orders_view.scrollToBottom()
+
+    def load_orders(self):
+        if self.store.exists():
+            # An interrupted workbook import is finished once the store history is in
+            self.resume_workbook_import = os.path.exists(HISTORY_IMPORT_MARKER) and os.path.exists("orders.xlsx")
+            self.read_orders_from_store()
+        elif os.path.exists("orders.xlsx"):
+            self.read_orders_from_excel("orders.xlsx")
+
+    def read_orders_from_store(self):
+        # Today's unfinished orders come from the status and creation_time
+        # indexes before the window appears, the rest streams in on a loader thread.
+        phase_start = time.perf_counter()
+        today = datetime.date.today().strftime('%Y-%m-%d')
+        records = self.store.load_open_orders(today)
+        Order.order_counter = max(Order.order_counter, self.store.max_order_number() + 1)
+        print(f"Order store queried in {(time.perf_counter() - phase_start) * 1000:.0f} ms: "
+              f"{len(records)} open orders today.")
+
+        phase_start = time.perf_counter()
+        for record in records:
+            order = Order.from_record(record)
+            self.orders.add(order)
+            self.mark_dirty(order)
+        self.orders_model.set_orders(self.orders.sorted())
+        print(f"Open orders loaded in {(time.perf_counter() - phase_start) * 1000:.0f} ms.")
+
+        self.start_history_loader(self.store.history_records(today), import_into_store=False)
+
+    def read_orders_from_excel(self, file_path):
+        # Only today's unfinished orders are parsed before the window appears,
+        # the rest of the history is parsed on a loader thread. Orders already
+        # in the store (from an interrupted earlier import) are kept as they are.
+        with open(HISTORY_IMPORT_MARKER, "w"):
+            pass
+        phase_start = time.perf_counter()
+        workbook = load_workbook(file_path, read_only=True)
+        worksheet = workbook.active
+        print(f"Workbook opened in {(time.perf_counter() - phase_start) * 1000:.0f} ms.")
+
+        phase_start = time.perf_counter()
+        today = datetime.date.today().strftime('%Y-%m-%d')
+        open_rows = []
+        history_rows = []
+        highest_number = 0
+        for row in worksheet.iter_rows(min_row=2, values_only=True):
+            if not row or row[0] is None:
+                continue
+            try:
+                order_number = int(row[0])
+            except (TypeError, ValueError):
+                print(f"Skipping workbook row with an unreadable order number: {row}")
+                continue
+            # New orders must not reuse a number that is still only in the history
+            highest_number = max(highest_number, order_number)
+            if self.orders.get(order_number) is not None:
+                continue
+            if str(row[1]).startswith(today) and row[7] != "picked up":
+                open_rows.append(row)
+            else:
+                history_rows.append(row)
+        workbook.close()
+        Order.order_counter = max(Order.order_counter, highest_number + 1)
+        print(f"Workbook scanned in {(time.perf_counter() - phase_start) * 1000:.0f} ms: "
+              f"{len(open_rows)} open orders today, {len(history_rows)} in history.")
+
+        phase_start = time.perf_counter()
+        open_orders = [Order.from_record(record) for record in excel_history_records(open_rows)]
+        for order in open_orders:
+            self.orders.add(order)
+            self.mark_dirty(order)
+        self.orders_model.set_orders(self.orders.sorted())
+        self.store.import_orders([order.to_record() for order in open_orders])
+        print(f"Open orders loaded in {(time.perf_counter() - phase_start) * 1000:.0f} ms.")
+
+        if history_rows:
+            self.start_history_loader(excel_history_records(history_rows), import_into_store=True)
         else:
-            self.workbook = Workbook()
-            self.worksheet = self.workbook.active
-            self.worksheet.title = "Orders"
-            headers = ["Order Number", "Creation Time", "Customer Name",
-                       "Food Items", "Bar Items", "card_or_cash", "Total Cost", "Status"]
-            self.worksheet.append(headers)
-            self.workbook.save("orders.xlsx")
-            print("New workbook created.")
-
-    def read_orders_from_excel(self):
-        for row in self.worksheet.iter_rows(min_row=2, values_only=True):
-            order_number, creation_time, customer_name, food_items, bar_items, c_or_c, total_cost, status = row
-
-            creation_time = datetime.datetime.strptime(creation_time, '%Y-%m-%d %H:%M:%S')
-
-            food_dict = {}
-            bar_dict = {}
-            if food_items:
-                food_item_list = food_items.split(", ")
-                for item in food_item_list:
-                    name, quantity = item.split(" x")
-                    food_dict[name] = int(quantity)
-
-            if bar_items:
-                bar_list = bar_items.split(", ")
-                for item in bar_list:
-                    name, quantity = item.split(" x")
-                    bar_dict[name] = int(quantity)
-
-            order = Order(
-                order_number=order_number,
-                food_items=food_dict,
-                bar_items=bar_dict,
-                customer_name=customer_name,
-                creation_time=creation_time,
-                card_or_cash=c_or_c,
-                total_cost=total_cost,
-                status=status
-            )
-
-            self.orders_list.append(order)
-
-    def save_orders_to_excel(self):
-        self.worksheet.delete_rows(2, self.worksheet.max_row)
-
-        all_orders = self.orders_list
-        all_orders.sort(key=lambda order: order.order_number)
-
-        for order in all_orders:
-            order_number = order.order_number
-            creation_time = order.creation_time.strftime('%Y-%m-%d %H:%M:%S')
-            customer_name = order.customer_name or "N/A"
-            food_items = ", ".join([f"{item} x{quantity}" for item, quantity in (order.food_items | order.drink_items).items()])
-            bar_items = ", ".join([f"{item} x{quantity}" for item, quantity in order.bar_items.items()])
-            c_or_c = order.card_or_cash
-            total_cost = order.total_cost if isinstance(order.total_cost, (int, float)) else str(order.total_cost)
-            status = order.status
-
-            self.worksheet.append([order_number, creation_time, customer_name,
-                                   food_items, bar_items, c_or_c, total_cost, status])
-
-        self.workbook.save("orders.xlsx")
+            os.remove(HISTORY_IMPORT_MARKER)
+
+    def start_history_loader(self, records, import_into_store):
+        self.history_merge_seconds = 0
+        self.history_loader = OrderHistoryLoaderThread(records, import_into_store)
+        self.history_loader.batch_loaded.connect(self.handle_history_batch)
+        self.history_loader.loading_finished.connect(self.handle_history_finished)
+        self.history_loader.start()
+
+    def handle_history_batch(self, orders, records):
+        phase_start = time.perf_counter()
+        for order in orders:
+            self.orders.add(order)
+            self.mark_dirty(order)
+        if self.history_loader.import_into_store:
+            self.store.import_orders(records)
+        self.history_merge_seconds += time.perf_counter() - phase_start
+
+    def handle_history_finished(self, count, seconds):
+        # loading_finished is the last thing run() does, so this wait is short
+        loader = self.history_loader
+        loader.wait()
+        self.history_loader = None
+        if loader.import_into_store:
+            os.remove(HISTORY_IMPORT_MARKER)
+        phase_start = time.perf_counter()
+        self.update_displays()
+        print(f"Order history: {count} orders built in {seconds * 1000:.0f} ms on the loader thread, "
+              f"merged in {self.history_merge_seconds * 1000:.0f} ms and shown in "
+              f"{(time.perf_counter() - phase_start) * 1000:.0f} ms on the GUI thread.")
+
+        if self.resume_workbook_import:
+            self.resume_workbook_import = False
+            print("The last workbook import did not finish, importing the remaining history.")
+            self.read_orders_from_excel("orders.xlsx")
+
+    def record_new_order(self, order):
+        self.store.create_order(order.to_record())
+        self.mark_dirty(order)
+        self.pending_row_changes[order.order_number] = order
+        self.refresh.mark_dirty("manager")
+
+    def record_order_change(self, order, *fields):
+        record = order.to_record()
+        self.store.update_order(order.order_number, {field: record[field] for field in fields})
+        self.mark_dirty(order)
+        self.pending_row_changes[order.order_number] = order
+        self.refresh.mark_dirty("manager")
+
+    def record_order_deletion(self, order):
+        self.store.delete_order(order.order_number)
+        self.pending_row_changes.pop(order.order_number, None)
+        self.orders_model.order_removed(order)
+        self.mark_screens_dirty({order.status})
+        self.refresh.mark_dirty("persistence", "info")
+        self.revenue.remove(order)
+        self.dirty_orders.pop(order.order_number, None)
+        if order.sheet_row is not None:
+            # Rows below the deleted one move up, keep their positions in step
+            self.pending_sheet_changes.append(("delete", order.sheet_row, None))
+            for other in self.orders:
+                if other.sheet_row is not None and other.sheet_row > order.sheet_row:
+                    other.sheet_row -= 1
+            self.next_sheet_row -= 1
+            order.sheet_row = None
+
+    def mark_dirty(self, order):
+        previous_status = self.orders.reindex(order)
+        order.dirty = True
+        self.dirty_orders[order.order_number] = order
+        self.revenue.update(order)
+        self.mark_screens_dirty({order.status, previous_status})
+        self.refresh.mark_dirty("persistence", "info")
+
+    def mark_screens_dirty(self, statuses):
+        # The kitchen shows active orders, the customer board active and completed ones
+        if "active" in statuses:
+            self.refresh.mark_dirty("kitchen")
+        if "active" in statuses or "completed" in statuses:
+            self.refresh.mark_dirty("customer")
+
+    def export_orders_to_excel(self):
+        if self.history_loader is not None:
+            # Exporting now would overwrite the workbook history that is still being read
+            return
+        # Only changed orders are sent: new ones get the next free row, the rest
+        # overwrite their own row. The writer gets an immutable tuple of changes.
+        changes = self.pending_sheet_changes
+        for order in sorted(self.dirty_orders.values(), key=lambda order: order.order_number):
+            if order.sheet_row is None:
+                order.sheet_row = self.next_sheet_row
+                self.next_sheet_row += 1
+            changes.append(("write", order.sheet_row, order_to_excel_row(order)))
+            order.dirty = False
+        self.dirty_orders.clear()
+        self.pending_sheet_changes = []
+
+        if changes:
+            self.excel_writer.submit(tuple(changes))
+
+    def handle_excel_saved(self, file_path, seconds, size):
+        self.last_export_info = (f"{datetime.datetime.now().strftime('%H:%M:%S')}, "
+                                 f"{seconds * 1000:.0f} ms, {size / 1024:.1f} KB")
+        print(f"Orders exported to {file_path} in {seconds * 1000:.0f} ms ({size} bytes).")
+        self.refresh.mark_dirty("info")
+
+    def closeEvent(self, event):
+        if self.history_loader is not None:
+            # An unfinished workbook import is redone on the next start, HISTORY_IMPORT_MARKER is still there
+            self.history_loader.requestInterruption()
+            self.history_loader.wait()
+        self.export_orders_to_excel()
+        self.excel_writer.stop()
+        self.rpi_link.stop()
+        self.store.close()
+        self.print_spooler.stop()
+        printer_session.close()
+        super().closeEvent(event)
 
     def print_select_order(self):
         dialog = PrintOrderDialog(self)
         dialog.exec_()
 
-    def clear_layout(self, layout):
-        if layout is not None:
-            while layout.count():
-                item = layout.takeAt(0)
-                widget = item.widget()
-                if widget is not None:
-                    widget.setParent(None)
-                    widget.deleteLater()
-                else:
-                    self.clear_layout(item.layout())
+    def queue_print(self, order):
+        if not self.print_spooler.submit(print_job(order)):
+            QMessageBox.warning(self, "Print Queue Full",
+                                f"Order {order.order_number} was not printed, {self.print_spooler.max_jobs} "
+                                f"receipts are already waiting for the printer.")
 
     def toggle_order_print(self):
         NewOrderDialog.order_print = not NewOrderDialog.order_print
-        self.update_info_widget()
+        if NewOrderDialog.order_print:
+            # Only worth the CPU once receipts are actually printed
+            number_rasters.prerender(Order.order_counter)
+        self.refresh.mark_dirty("info")
 
     def update_info_widget(self):
         status = "Enabled" if NewOrderDialog.order_print else "Disabled"
         connection_status = "Connected" if self.rpi_connected else "Disconnected"
+        if self.rpi_connected:
+            connection_status += f" ({self.rpi_link.summary()})"
         connection_style = "" if self.rpi_connected else "background-color: red;"
 
         self.info_widget.setHtml(f"""
@@ -412,173 +563,594 @@ class KitchenManagerApp(QMainWindow):
             <body>
             <h2>Information Panel</h2>
             <p>Order Print: {status}</p>
+            <p>Print queue: {self.print_spooler.summary()}</p>
             <p style='{connection_style}'>RPi: {connection_status}</p>
+            <p>Revenue today: {self.revenue.summary()}</p>
+            <p>Last Excel export: {self.last_export_info}</p>
+            <p>Refresh stages: {self.refresh.summary()}</p>
             </body>
             </html>
         """)
 
-    def start_ping(self):
-        self.ping_thread = PingThread(self.rpi_ip, self.rpi_port)
-        self.ping_thread.ping_result.connect(self.handle_ping_result)
-        self.ping_thread.start()
+    def send_update_to_rpi(self):
+        # The link turns the new board into a delta against what the display already has
+        board = {order.order_number: "active" for order in self.orders.with_status("active")}
+        completed = self.orders.with_status("completed")[-self.rpi_completed_window:]
+        board.update((order.order_number, "completed") for order in completed)
+        self.rpi_link.publish(board)
 
-        # Set a timeout for the thread
-        QTimer.singleShot(2000, self.ping_thread.quit)
+    def refresh_rpi_info(self):
+        if self.rpi_connected:
+            self.refresh.mark_dirty("info")
 
-    def handle_ping_result(self, connected):
+    def handle_rpi_connection_changed(self, connected):
         self.rpi_connected = connected
-        self.update_info_widget()
+        self.refresh.mark_dirty("info")
 
-    def send_update_to_rpi(self):
-        active_order_numbers = [order.order_number for order in self.orders_list if order.status == "active"]
-        completed_order_numbers = [order.order_number for order in self.orders_list if order.status == "completed"]
 
-        data = {
-            'active_orders': active_order_numbers,
-            'completed_orders': completed_order_numbers
-        }
+def order_to_excel_row(order):
+    food_items = ", ".join([f"{item} x{quantity}" for item, quantity in (order.food_items | order.drink_items).items()])
+    bar_items = ", ".join([f"{item} x{quantity}" for item, quantity in order.bar_items.items()])
+    total_cost = order.total_cost if isinstance(order.total_cost, (int, float)) else str(order.total_cost)
+    return (order.order_number, order.creation_time.strftime(Order.time_format), order.customer_name or "N/A",
+            food_items, bar_items, order.card_or_cash, total_cost, order.status)
 
-        self.rpi_thread = QThread()
-        self.rpi_worker = RPiUpdateThread(self.rpi_ip, self.rpi_port, data)
-        self.rpi_worker.moveToThread(self.rpi_thread)
 
-        self.rpi_thread.started.connect(self.rpi_worker.run)
-        self.rpi_worker.update_complete.connect(self.handle_rpi_update_complete)
-        self.rpi_worker.update_complete.connect(self.rpi_thread.quit)
-        self.rpi_thread.finished.connect(self.rpi_thread.deleteLater)
-        self.rpi_worker.update_complete.connect(self.rpi_worker.deleteLater)
+class OrdersTableModel(QAbstractTableModel):
+    # Every order as one table row, sorted by order number
 
-        self.rpi_thread.start()
+    headers = ["Order #", "Time", "Customer Name", "Food Items", "Drink Items", "Card or Cash", "Total Price"]
 
-    def handle_rpi_update_complete(self, success):
-        self.rpi_connected = success
-        self.update_info_widget()
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.orders = []
+        self.order_numbers = []
 
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.orders)
 
-class PingThread(QThread):
-    ping_result = pyqtSignal(bool)
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.headers)
 
-    def __init__(self, rpi_ip, rpi_port):
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        order = self.orders[index.row()]
+        if role == Qt.DisplayRole:
+            return self.column_text(order, index.column())
+        elif role == Qt.UserRole:
+            return order.status
+        return None
+
+    @staticmethod
+    def column_text(order, column):
+        if column == 0:
+            return str(order.order_number)
+        elif column == 1:
+            return order.creation_time.strftime('%H:%M:%S')
+        elif column == 2:
+            return order.customer_name or 'N/A'
+        elif column == 3:
+            return ', '.join([f'{item} x {quantity}' for item, quantity in (order.food_items | order.drink_items).items()])
+        elif column == 4:
+            return ', '.join([f'{item} x {quantity}' for item, quantity in order.bar_items.items()])
+        elif column == 5:
+            return order.card_or_cash
+        elif column == 6:
+            return f"{order.total_cost:.2f}€" if isinstance(order.total_cost, (int, float)) else str(order.total_cost)
+
+    def set_orders(self, orders):
+        self.beginResetModel()
+        self.orders = list(orders)
+        self.order_numbers = [order.order_number for order in self.orders]
+        self.endResetModel()
+
+    def order_changed(self, order):
+        row = bisect_left(self.order_numbers, order.order_number)
+        if row < len(self.order_numbers) and self.order_numbers[row] == order.order_number:
+            self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.headers) - 1))
+        else:
+            self.beginInsertRows(QModelIndex(), row, row)
+            self.orders.insert(row, order)
+            self.order_numbers.insert(row, order.order_number)
+            self.endInsertRows()
+
+    def order_removed(self, order):
+        row = bisect_left(self.order_numbers, order.order_number)
+        if row < len(self.order_numbers) and self.order_numbers[row] == order.order_number:
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self.orders[row]
+            del self.order_numbers[row]
+            self.endRemoveRows()
+
+
+class StatusColorDelegate(QStyledItemDelegate):
+    status_colors = {
+        "active": QColor("red"),
+        "completed": QColor("yellow"),
+        "picked up": QColor("green"),
+        "bar": QColor("blue"),
+    }
+
+    def paint(self, painter, option, index):
+        color = self.status_colors.get(index.data(Qt.UserRole))
+        if color is not None:
+            painter.fillRect(option.rect, color)
+        super().paint(painter, option, index)
+
+
+def order_record_from_excel_row(row):
+    order_number, creation_time, customer_name, food_items, bar_items, c_or_c, total_cost, status = row[:8]
+
+    food_dict = {}
+    bar_dict = {}
+    if food_items:
+        for item in food_items.split(", "):
+            name, quantity = item.split(" x")
+            food_dict[name] = int(quantity)
+
+    if bar_items:
+        for item in bar_items.split(", "):
+            name, quantity = item.split(" x")
+            bar_dict[name] = int(quantity)
+
+    return {
+        "order_number": int(order_number),
+        "creation_time": datetime.datetime.strptime(creation_time, Order.time_format),
+        "customer_name": customer_name,
+        "food_items": food_dict,
+        "drink_items": {},
+        "bar_items": bar_dict,
+        "total_cost": total_cost,
+        "status": status,
+        "card_or_cash": c_or_c,
+    }
+
+
+def excel_history_records(rows):
+    for row in rows:
+        try:
+            yield order_record_from_excel_row(row)
+        except (TypeError, ValueError) as e:
+            print(f"Skipping unreadable workbook row {row}: {e}")
+
+
+class OrderHistoryLoaderThread(QThread):
+    # Builds history orders off the GUI thread and hands them over in batches.
+    # The counter is already past every stored number, so building orders here
+    # never moves Order.order_counter.
+    batch_loaded = pyqtSignal(list, list)
+    loading_finished = pyqtSignal(int, float)
+
+    batch_size = 2000
+
+    def __init__(self, records, import_into_store):
         super().__init__()
-        self.rpi_ip = rpi_ip
-        self.rpi_port = rpi_port
+        self.records = records
+        self.import_into_store = import_into_store
 
     def run(self):
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.setblocking(False)
-                try:
-                    s.connect((self.rpi_ip, self.rpi_port))
-                except BlockingIOError:
-                    pass
+        start = time.perf_counter()
+        count = 0
+        orders = []
+        records = []
+        for record in self.records:
+            try:
+                order = Order.from_record(record)
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"Skipping unreadable order record {record}: {e}")
+                continue
+            orders.append(order)
+            if self.import_into_store:
+                records.append(order.to_record())
+            if len(orders) >= self.batch_size:
+                if self.isInterruptionRequested():
+                    return
+                count += len(orders)
+                self.batch_loaded.emit(orders, records)
+                orders = []
+                records = []
+        count += len(orders)
+        self.batch_loaded.emit(orders, records)
+        self.loading_finished.emit(count, time.perf_counter() - start)
+
+
+class ExcelWriterThread(QThread):
+    save_finished = pyqtSignal(str, float, int)
+
+    headers = ["Order Number", "Creation Time", "Customer Name",
+               "Food Items", "Bar Items", "card_or_cash", "Total Cost", "Status"]
+
+    def __init__(self, file_path):
+        super().__init__()
+        self.file_path = file_path
+        self.condition = threading.Condition()
+        self.pending_changes = []
+        self.pending_writes = {}
+        self.running = True
+        self.workbook = None
+        self.worksheet = None
+
+    def submit(self, changes):
+        # A burst of submits collapses into one save, and repeated writes to the
+        # same row keep only the newest values. A row delete shifts the rows
+        # below it, so writes queued before it are never merged with later ones.
+        with self.condition:
+            for change in changes:
+                action, row, values = change
+                if action == "write" and row in self.pending_writes:
+                    self.pending_changes[self.pending_writes[row]] = change
+                elif action == "write":
+                    self.pending_writes[row] = len(self.pending_changes)
+                    self.pending_changes.append(change)
+                else:
+                    self.pending_writes.clear()
+                    self.pending_changes.append(change)
+            self.condition.notify()
 
-                readable, writable, _ = select.select([], [s], [], 1.0)
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending_changes and self.running:
+                    self.condition.wait()
+                if not self.pending_changes:
+                    return
+                changes = self.pending_changes
+                self.pending_changes = []
+                self.pending_writes = {}
+
+            try:
+                self.write_workbook(changes)
+            except Exception as e:
+                print(f"Error writing {self.file_path}: {e}")
+
+    def write_workbook(self, changes):
+        start = time.perf_counter()
+        if self.workbook is None:
+            # The manager assigns rows from 2 on each run, so start from an empty sheet
+            self.workbook = Workbook()
+            self.worksheet = self.workbook.active
+            self.worksheet.title = "Orders"
+            self.worksheet.append(self.headers)
+
+        for action, row, values in changes:
+            if action == "write":
+                for column, value in enumerate(values, 1):
+                    self.worksheet.cell(row=row, column=column, value=value)
+            elif action == "delete":
+                self.worksheet.delete_rows(row)
+
+        # Write next to the target and rename so a crash never leaves a half-written file
+        temp_path = self.file_path + ".tmp"
+        self.workbook.save(temp_path)
+        os.replace(temp_path, self.file_path)
+        self.save_finished.emit(self.file_path, time.perf_counter() - start, os.path.getsize(self.file_path))
 
-                if writable:
-                    s.sendall(b'ping')
-                    readable, _, _ = select.select([s], [], [], 1.0)
-                    if readable:
-                        response = s.recv(1024)
-                        if response == b'pong':
-                            self.ping_result.emit(True)
-                            return
 
-                self.ping_result.emit(False)
-        except Exception as e:
-            print(f"Error pinging RPi: {e}")
-            self.ping_result.emit(False)
+class RPiLink(QThread):
+    # Long-lived connection to the customer display: a snapshot on connect and resync,
+    # then deltas of the newest published board, plus heartbeats and acks.
 
+    connection_changed = pyqtSignal(bool)
 
-class RPiUpdateThread(QObject):
-    update_complete = pyqtSignal(bool)
+    min_retry_interval = 0.5
+    max_retry_interval = 30
+    heartbeat_interval = 1
+    ack_timeout = 5
 
-    def __init__(self, rpi_ip, rpi_port, data):
+    def __init__(self, rpi_ip, rpi_port):
         super().__init__()
         self.rpi_ip = rpi_ip
         self.rpi_port = rpi_port
-        self.data = data
+        self.condition = threading.Condition()
+        self.pending = deque(maxlen=1)
+        self.board = {}
+        self.running = True
+        self.round_trips = deque(maxlen=500)
+        self.sent_seq = 0
+        self.acked_seq = 0
+        self.last_ack_time = None
+        # publish() and stop() write a byte here to wake the select() in stream()
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+
+    def wake(self):
+        try:
+            self.wakeup_writer.send(b"\0")
+        except OSError:
+            pass  # Buffer full, a wakeup is already pending
+
+    def publish(self, board):
+        with self.condition:
+            self.pending.append(board)
+            self.condition.notify()
+        self.wake()
+
+    def summary(self):
+        with self.condition:
+            round_trips = sorted(self.round_trips)
+            pending = self.sent_seq - self.acked_seq
+            last_ack_time = self.last_ack_time
+        if not round_trips or last_ack_time is None:
+            return f"{pending} pending"
+        p50 = round_trips[len(round_trips) // 2] * 1000
+        p99 = round_trips[min(len(round_trips) - 1, int(len(round_trips) * 0.99))] * 1000
+        return (f"RTT p50 {p50:.0f} ms / p99 {p99:.0f} ms, last ack {time.monotonic() - last_ack_time:.1f} s ago, "
+                f"{pending} pending")
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.wake()
+        self.wait()
+        self.wakeup_reader.close()
+        self.wakeup_writer.close()
 
     def run(self):
-        try:
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                s.settimeout(2)  # Set a 2-second timeout
-                s.connect((self.rpi_ip, self.rpi_port))
-                json_data = json.dumps(self.data)
-                s.sendall(json_data.encode())
-            print(f"Sent data to RPi: {json_data}")  # Debug print
-            self.update_complete.emit(True)
-        except (socket.timeout, ConnectionRefusedError):
-            print("Raspberry Pi is not reachable. Continuing without sending update.")
-            self.update_complete.emit(False)
-        except Exception as e:
-            print(f"Unexpected error when trying to send update to Raspberry Pi: {e}")
-            self.update_complete.emit(False)
+        retry_interval = self.min_retry_interval
+        while self.running:
+            try:
+                connection = socket.create_connection((self.rpi_ip, self.rpi_port), timeout=2)
+            except OSError:
+                with self.condition:
+                    self.condition.wait_for(lambda: not self.running, timeout=retry_interval)
+                retry_interval = min(retry_interval * 2, self.max_retry_interval)
+                continue
+
+            retry_interval = self.min_retry_interval
+            self.connection_changed.emit(True)
+            try:
+                with connection:
+                    self.stream(connection)
+            except (OSError, ValueError) as e:
+                print(f"Connection to Raspberry Pi lost: {e}")
+            self.connection_changed.emit(False)
+
+    def send(self, connection, message):
+        message["t"] = time.monotonic()
+        connection.sendall(encode_message(message))
+        return message["t"]
+
+    def handle_ack(self, message):
+        now = time.monotonic()
+        with self.condition:
+            if message.get("t") is not None:
+                self.round_trips.append(now - message["t"])
+            if message.get("seq") is not None:
+                self.acked_seq = max(self.acked_seq, message["seq"])
+            self.last_ack_time = now
+
+    def stream(self, connection):
+        decoder = FrameDecoder()
+        sent_board = None
+        seq = 0
+        with self.condition:
+            self.sent_seq = 0
+            self.acked_seq = 0
+            self.last_ack_time = None
+        connected_at = last_sent = time.monotonic()
+        while True:
+            # Sleep on the socket itself so an ack is timed the moment it arrives
+            timeout = max(0, last_sent + self.heartbeat_interval - time.monotonic())
+            readable, _, _ = select.select([connection, self.wakeup_reader], [], [], timeout)
+            if self.wakeup_reader in readable:
+                try:
+                    while self.wakeup_reader.recv(4096):
+                        pass
+                except BlockingIOError:
+                    pass
+
+            with self.condition:
+                if not self.running:
+                    return
+                if self.pending:
+                    self.board = self.pending.pop()
+                board = self.board
+
+            if connection in readable:
+                data = connection.recv(65536)
+                if not data:
+                    raise ConnectionError("Raspberry Pi closed the connection")
+                for frame in decoder.feed(data):
+                    message = json.loads(frame.decode())
+                    if message.get("type") == "ack":
+                        self.handle_ack(message)
+                    elif message.get("type") == "resync":
+                        print("Raspberry Pi requested a resync.")
+                        sent_board = None
+
+            if sent_board is None:
+                seq += 1
+                last_sent = self.send(connection, snapshot_message(seq, board))
+                sent_board = board
+            elif board is not sent_board:
+                changes = board_changes(sent_board, board)
+                if changes:
+                    seq += 1
+                    last_sent = self.send(connection, delta_message(seq, changes))
+                sent_board = board
+            with self.condition:
+                self.sent_seq = seq
+                last_ack_time = self.last_ack_time or connected_at
+
+            now = time.monotonic()
+            if now - last_ack_time > self.ack_timeout:
+                raise TimeoutError(f"No acknowledgement from Raspberry Pi for {self.ack_timeout} s")
+            if now - last_sent >= self.heartbeat_interval:
+                last_sent = self.send(connection, heartbeat_message(seq))
+
+
+class KitchenTicket(QFrame):
+    def __init__(self, font, parent=None):
+        super().__init__(parent)
+        self.setObjectName("ticket")
+        order_layout = QVBoxLayout(self)
+        order_layout.setContentsMargins(5, 5, 5, 5)
+        self.label = QLabel()
+        self.label.setFont(font)
+        self.label.setAlignment(Qt.AlignCenter)
+        order_layout.addWidget(self.label)
+        self.text = None
+        self.ticket_height = 0
+
+    def show_order(self, order):
+        food_items = order.food_items
+        order_items = "\n ".join([f"{item} x{quantity}" for item, quantity in food_items.items()])
+        text = (
+            f"#{order.order_number}\n"
+            f"{order_items}"
+        )
+        if text != self.text:
+            self.text = text
+            self.label.setText(text)
+            # Measured from the label's font metrics rather than estimated per line
+            self.ticket_height = self.sizeHint().height()
+
+
+def pack_tickets(heights, column_count, column_height, spacing):
+    # Fills columns top to bottom in queue order so the oldest tickets stay top
+    # left, and starts a new page when every column is full. Returns pages of
+    # columns, each column a list of (ticket index, y offset).
+    pages = []
+    column = column_count
+    y = 0
+    for index, height in enumerate(heights):
+        if column < column_count and y > 0 and y + height > column_height:
+            column += 1
+            y = 0
+        if column == column_count:
+            pages.append([[] for _ in range(column_count)])
+            column = 0
+            y = 0
+        pages[-1][column].append((index, y))
+        y += height + spacing
+    return pages
 
 
 class KitchenWindow(QWidget):
+    # Released tickets are kept hidden for reuse, up to this many
+    ticket_pool_size = 30
+    margin = 10
+    spacing = 6
+    min_column_width = 380
+    page_interval = 5000
+
     def __init__(self, parent=None):
         super().__init__()
         self.parent = parent
         self.setWindowTitle("Kitchen Display")
         self.setGeometry(400, 400, 1200, 800)  # Increased size to accommodate columns
-
-        self.main_layout = QVBoxLayout(self)
+        # One style sheet for all tickets instead of one per frame
+        self.setStyleSheet("QFrame#ticket { background-color: rgba(255, 0, 0, 255); padding: 2px; }")
+
+        self.ticket_font = QFont("", 30)
+        self.tickets = {}
+        self.ticket_pool = []
+        self.active_orders = []
+
+        # When the queue does not fit on screen the pages rotate instead of scrolling
+        self.pages = []
+        self.page = 0
+        self.page_label = QLabel(self)
+        self.page_label.setFont(QFont("", 20, QFont.Bold))
+        self.page_label.hide()
+        self.page_timer = QTimer(self)
+        self.page_timer.timeout.connect(self.next_page)
 
     def update_display(self, active_orders):
-        self.clear_layout(self.main_layout)
-        active_orders.sort(key=lambda order: order.order_number)
-        h_layout = QHBoxLayout()
-        self.main_layout.addLayout(h_layout)
-
-        left_column = QVBoxLayout()
-        middle_column = QVBoxLayout()
-        right_column = QVBoxLayout()
-        h_layout.addLayout(left_column)
-        h_layout.addLayout(middle_column)
-        h_layout.addLayout(right_column)
+        # Tickets are cached by order number: only new, finished or edited orders touch a widget
+        active_numbers = {order.order_number for order in active_orders}
+        for order_number in [number for number in self.tickets if number not in active_numbers]:
+            self.release_ticket(self.tickets.pop(order_number))
+
+        for order in active_orders:
+            ticket = self.tickets.get(order.order_number)
+            if ticket is None:
+                ticket = self.acquire_ticket()
+                self.tickets[order.order_number] = ticket
+            ticket.show_order(order)
+
+        self.active_orders = sorted(active_orders, key=lambda order: order.order_number)
+        self.place_tickets()
+
+    def acquire_ticket(self):
+        if self.ticket_pool:
+            return self.ticket_pool.pop()
+        return KitchenTicket(self.ticket_font, self)
+
+    def release_ticket(self, ticket):
+        ticket.hide()
+        if len(self.ticket_pool) < self.ticket_pool_size:
+            self.ticket_pool.append(ticket)
+        else:
+            ticket.deleteLater()
+
+    def place_tickets(self):
+        page_label_height = self.page_label.sizeHint().height()
+        column_height = self.height() - 2 * self.margin - page_label_height
+        usable_width = self.width() - 2 * self.margin
+        column_count = max(1, (usable_width + self.spacing) // (self.min_column_width + self.spacing))
+        column_width = (usable_width - (column_count - 1) * self.spacing) // column_count
+
+        heights = [self.tickets[order.order_number].ticket_height for order in self.active_orders]
+        self.pages = pack_tickets(heights, column_count, column_height, self.spacing)
+        if self.page >= len(self.pages):
+            self.page = 0
+
+        if len(self.pages) > 1:
+            if not self.page_timer.isActive():
+                self.page_timer.start(self.page_interval)
+        else:
+            self.page_timer.stop()
+
+        self.show_page(column_width)
+
+    def show_page(self, column_width):
+        shown = set()
+        if self.pages:
+            for column, entries in enumerate(self.pages[self.page]):
+                x = self.margin + column * (column_width + self.spacing)
+                for index, y in entries:
+                    ticket = self.tickets[self.active_orders[index].order_number]
+                    geometry = QRect(x, self.margin + y, column_width, ticket.ticket_height)
+                    if ticket.geometry() != geometry:
+                        ticket.setGeometry(geometry)
+                    ticket.show()
+                    shown.add(ticket)
+
+        for ticket in self.tickets.values():
+            if ticket not in shown:
+                ticket.hide()
+
+        if len(self.pages) > 1:
+            self.page_label.setText(f"{self.page + 1}/{len(self.pages)}")
+            self.page_label.adjustSize()
+            self.page_label.move(self.width() - self.margin - self.page_label.width(),
+                                 self.height() - self.margin - self.page_label.height())
+            self.page_label.show()
+        else:
+            self.page_label.hide()
 
-        total_height = 0
-        for i, order in enumerate(active_orders):
-            order_widget, order_height = self.create_order_widget(order)
-            total_height += order_height
-            if total_height < 980:
-                left_column.addWidget(order_widget)
-            elif i < 1960:
-                middle_column.addWidget(order_widget)
-            elif i < 2940:
-                right_column.addWidget(order_widget)
-        left_column.addStretch(1)
-        middle_column.addStretch(1)
-        right_column.addStretch(1)
+    def next_page(self):
+        if self.pages:
+            self.page = (self.page + 1) % len(self.pages)
+        self.place_tickets()
 
-    def create_order_widget(self, order):
-        order_widget = QFrame()
-        order_widget.setStyleSheet("background-color: rgba(255, 0, 0, 255); padding: 2px;")
-        order_layout = QVBoxLayout(order_widget)
-        order_layout.setContentsMargins(5, 5, 5, 5)
-        order_items = "\n ".join([f"{item} x{quantity}" for item, quantity in order.food_items.items()])
-        order_info = (
-            f"#{order.order_number}\n"
-            f"{order_items}"
-        )
-        order_label = QLabel(order_info)
-        order_label.setFont(QFont("", 30))
-        order_label.setAlignment(Qt.AlignCenter)
-        order_layout.addWidget(order_label)
-        widget_height = 70 + 70 * len(order.food_items)
-        order_widget.setFixedHeight(widget_height)
-        return order_widget, widget_height
-
-    def clear_layout(self, layout):
-        if layout is not None:
-            while layout.count():
-                item = layout.takeAt(0)
-                widget = item.widget()
-                if widget is not None:
-                    widget.setParent(None)
-                    widget.deleteLater()
-                else:
-                    self.clear_layout(item.layout())
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.place_tickets()
 
 
 class CustomerWindow(QWidget):
@@ -800,7 +1372,7 @@ class NewOrderDialog(QDialog):
 
     def set_shortcuts(self):
         QShortcut(QKeySequence(Qt.Key_Return), self, lambda: self.ask_for_payment())
-        for item, details in Order.combined_items_info.items():
+        for item, details in Order.menu.items.items():
             QShortcut(QKeySequence(details['key']), self, lambda ite=item: self.add_item(ite))
             QShortcut(QKeySequence(f"Shift+{details['key']}"), self, lambda ite=item: self.remove_item(ite))
 
@@ -861,7 +1433,7 @@ class NewOrderDialog(QDialog):
 
     def finish_order(self):
         if self.order_print:
-            print_order(self.new_order)
+            self.kitchenManager.queue_print(self.new_order)
         if not self.new_order.food_items and  not self.new_order.drink_items:
             self.new_order.status = "bar"
         elif not self.new_order.food_items and  not self.new_order.bar_items:
@@ -904,27 +1476,24 @@ class UpdateOrderDialog(QDialog):
             QMessageBox.warning(self, "Invalid Input", "Please enter a valid order number.")
             return
 
-        for order in self.kitchenManager.orders_list:
-            if order.order_number == order_number:
-                if order.status == "active":
-                    order.status = "completed"
-                    self.accept()
-                    break
-                elif order.status == "completed":
-                    order.status = "picked up"
-                    self.accept()
-                    break
-                elif order.status == "picked up":
-                    QMessageBox.information(self, "Order Already Done",
-                                            f"Order {order_number} is already in the 'done' state.")
-                    self.accept()
-                    break
-                elif order.status == "bar":
-                    self.accept()
-                    break
-        else:
+        order = self.kitchenManager.orders.get(order_number)
+        if order is None:
             QMessageBox.warning(self, "Order Not Found", f"No order found with number {order_number}")
             self.accept()
+        elif order.status == "active":
+            order.status = "completed"
+            self.kitchenManager.record_order_change(order, "status")
+            self.accept()
+        elif order.status == "completed":
+            order.status = "picked up"
+            self.kitchenManager.record_order_change(order, "status")
+            self.accept()
+        elif order.status == "picked up":
+            QMessageBox.information(self, "Order Already Done",
+                                    f"Order {order_number} is already in the 'done' state.")
+            self.accept()
+        elif order.status == "bar":
+            self.accept()
 
 
 class EditOrderDialog(QDialog):
@@ -935,6 +1504,8 @@ class EditOrderDialog(QDialog):
         self.layout = QVBoxLayout(self)
         self.selected_order = None
         self.edit_mode = None
+        # Item counts and totals from before edit_items, restored if the edit is cancelled
+        self.original_items = None
 
         self.init_ui()
 
@@ -995,11 +1566,11 @@ class EditOrderDialog(QDialog):
             QMessageBox.warning(self, "Invalid Input", "Please enter a valid order number.")
             return
 
-        for order in self.kitchenManager.orders_list:
-            if order.order_number == order_number:
-                self.selected_order = order
-                self.show_order_details()
-                return
+        order = self.kitchenManager.orders.get(order_number)
+        if order is not None:
+            self.selected_order = order
+            self.show_order_details()
+            return
 
         QMessageBox.warning(self, "Order Not Found", f"No order found with number {order_number}")
 
@@ -1018,6 +1589,7 @@ class EditOrderDialog(QDialog):
         new_name, ok = QInputDialog.getText(self, "Edit Name", "Enter new name:")
         if ok and new_name:
             self.selected_order.customer_name = new_name
+            self.kitchenManager.record_order_change(self.selected_order, "customer_name")
             self.accept()
 
     def edit_payment(self):
@@ -1029,12 +1601,13 @@ class EditOrderDialog(QDialog):
 
         def finalize_payment(payment_type):
             if payment_type == 'normal':
-                self.selected_order.total_cost = Order.calculate_total_price(self.selected_order.food_items)
+                self.selected_order.total_cost = Order.calculate_total_price(self.selected_order)
             elif payment_type == 'free':
                 self.selected_order.total_cost = 'free'
             elif payment_type == 'coupon':
                 self.selected_order.total_cost = 'coupon'
 
+            self.kitchenManager.record_order_change(self.selected_order, "total_cost")
             self.accept()
 
         if not self.selected_order:
@@ -1050,7 +1623,7 @@ class EditOrderDialog(QDialog):
             for shortcut in self.findChildren(QShortcut):
                 shortcut.setEnabled(False)
             QShortcut(QKeySequence(Qt.Key_Return), self, finalize_items)
-            for item, details in Order.combined_items_info.items():
+            for item, details in Order.menu.items.items():
                 QShortcut(QKeySequence(details['key']), self, lambda ite=item: add_item(ite))
                 QShortcut(QKeySequence(f"Shift+{details['key']}"), self, lambda ite=item: remove_item(ite))
 
@@ -1063,10 +1636,18 @@ class EditOrderDialog(QDialog):
             self.order_items_label.setText(Order.get_items_display(self.selected_order))
 
         def finalize_items():
+            self.original_items = None
             if isinstance(self.selected_order.total_cost, (int, float)):
                 self.selected_order.total_cost = Order.calculate_total_price(self.selected_order)
+            self.kitchenManager.record_order_change(self.selected_order, "food_items", "drink_items",
+                                                    "bar_items", "total_cost")
             self.accept()
 
+        if not self.selected_order:
+            return
+        order = self.selected_order
+        self.original_items = (array('H', order.item_counts), array('d', order.category_totals),
+                               order.totals_version, order.dirty)
         self.order_items_label.setText(Order.get_items_display(self.selected_order))
         self.edit_instructions.show()
         self.order_items_label.show()
@@ -1078,6 +1659,7 @@ class EditOrderDialog(QDialog):
 
         def change_status(status_type):
             self.selected_order.status = status_type
+            self.kitchenManager.record_order_change(self.selected_order, "status")
             self.accept()
 
         def set_shortcuts():
@@ -1105,6 +1687,7 @@ class EditOrderDialog(QDialog):
             elif payment_type == 'cash':
                 self.selected_order.card_or_cash = 'cash'
 
+            self.kitchenManager.record_order_change(self.selected_order, "card_or_cash")
             self.accept()
 
         if not self.selected_order:
@@ -1114,8 +1697,19 @@ class EditOrderDialog(QDialog):
         self.change_card_or_cash.show()
         set_shortcuts()
 
+    def reject(self):
+        # Items are edited in place, closing without Enter puts the old ones back
+        if self.original_items is not None:
+            order = self.selected_order
+            order.item_counts, order.category_totals, order.totals_version, order.dirty = self.original_items
+            self.original_items = None
+        super().reject()
+
     def delete_order(self):
-        self.kitchenManager.orders_list.remove(self.selected_order)
+        if not self.selected_order:
+            return
+        self.kitchenManager.orders.remove(self.selected_order)
+        self.kitchenManager.record_order_deletion(self.selected_order)
         self.accept()
 
 
@@ -1141,37 +1735,170 @@ class PrintOrderDialog(QDialog):
             QMessageBox.warning(self, "Invalid Input", "Please enter a valid order number.")
             return
 
-        for order in self.KitchenManager.orders_list:
-            if order.order_number == order_number:
-                print_order(order)
-                self.accept()
-                break
+        order = self.KitchenManager.orders.get(order_number)
+        if order is not None:
+            self.KitchenManager.queue_print(order)
+            self.accept()
         else:
             QMessageBox.warning(self, "Order Not Found", f"No order found with number {order_number}")
 
         self.order_input.clear()
 
 
-def print_order(order):
-    if order.bar_items:
-        print(order.bar_items)
-        print_text('Bari joogid:', size=2)
-        for item, count in order.bar_items.items():
-            print(f"{item} x{count}")
-            print_text(f"{item} x{count}")
-            print_text('\n\n\n\n\n\n\n\n')
-
-    if order.food_items:
-        print_text('Sinu tellimus:', size=2)
-        print('Sinu tellimus:')
-        for item, count in (order.food_items | order.drink_items).items():
-            print(f"{item} x{count}")
-            print_text(f"{item} x{count}")
-        print_text('Tellimuse nr:', size=2)
-        print('Tellimuse nr:')
-        print_image(f"{str(order.order_number).zfill(3)}")
-        print(f"{str(order.order_number).zfill(3)}")
-        print_text('\n\n\n\n\n\n\n\n')
+class PrintSpooler(QThread):
+    # Prints queued receipts off the GUI thread. Pending jobs survive a restart in
+    # PRINT_QUEUE_PATH, jobs that can never print are dropped as failed.
+
+    status_changed = pyqtSignal()
+
+    max_jobs = 50
+    retry_interval = 3
+
+    def __init__(self, path=PRINT_QUEUE_PATH):
+        super().__init__()
+        self.path = path
+        self.condition = threading.Condition()
+        self.jobs = deque(self.load_jobs())
+        self.running = True
+        self.printer_missing = False
+        self.last_latency = None
+        self.failed_jobs = 0
+
+    def load_jobs(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                jobs = json.load(f)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            print(f"Could not read pending print jobs from {self.path}: {e}")
+            return []
+        if not isinstance(jobs, list):
+            print(f"Ignoring {self.path}, it does not hold a list of print jobs")
+            return []
+        jobs = [job for job in jobs if isinstance(job, dict)]
+        if jobs:
+            print(f"Resuming {len(jobs)} pending print jobs")
+        return jobs
+
+    def save_jobs(self):
+        # Called with the condition held
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(list(self.jobs), f, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Could not save pending print jobs: {e}")
+
+    def submit(self, job):
+        with self.condition:
+            if len(self.jobs) >= self.max_jobs:
+                return False
+            self.jobs.append(job)
+            self.save_jobs()
+            self.condition.notify()
+        self.status_changed.emit()
+        return True
+
+    def summary(self):
+        with self.condition:
+            queued = len(self.jobs)
+            printer_missing = self.printer_missing
+            last_latency = self.last_latency
+            failed_jobs = self.failed_jobs
+        summary = f"{queued} queued"
+        if last_latency is not None:
+            summary += f", last job {last_latency:.1f} s"
+        if failed_jobs:
+            summary += f", {failed_jobs} failed"
+        if printer_missing:
+            summary += ", printer not found"
+        return summary
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.wait()
+
+    def run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: not self.running or self.jobs)
+                if not self.running:
+                    return
+                job = self.jobs[0]
+
+            if self.printer_missing and not printer_session.is_healthy():
+                # Wait for the printer to answer before sending the job again
+                with self.condition:
+                    self.condition.wait_for(lambda: not self.running, timeout=self.retry_interval)
+                continue
+
+            try:
+                receipt = receipt_for_job(job)
+            except Exception as e:
+                # Retrying cannot fix a malformed job or a missing font
+                self.finish_job(job, f"could not be rendered: {e!r}")
+                continue
+
+            try:
+                transfers = receipt.send() if receipt.buffer else 0
+            except (usb.core.USBError, ValueError) as e:
+                # Nothing was printed yet, a missing printer is a ValueError from init_printer()
+                print(f"Could not print order {job.get('order_number')}, retrying in {self.retry_interval} s: {e}")
+                with self.condition:
+                    self.printer_missing = True
+                self.status_changed.emit()
+                with self.condition:
+                    self.condition.wait_for(lambda: not self.running, timeout=self.retry_interval)
+                continue
+            except Exception as e:
+                # Includes PartialWriteError: the start of the receipt is already on paper
+                self.finish_job(job, f"failed while printing: {e!r}")
+                continue
+
+            print(f"Printed order {job.get('order_number')}: {len(receipt.buffer)} bytes in {transfers} USB transfers")
+            self.finish_job(job)
+
+    def finish_job(self, job, error=None):
+        if error:
+            print(f"Dropped print job for order {job.get('order_number')}, {error}. Reprint it with P.")
+        with self.condition:
+            self.jobs.popleft()
+            self.save_jobs()
+            if error:
+                self.failed_jobs += 1
+            else:
+                self.printer_missing = False
+                if isinstance(job.get("queued_at"), (int, float)):
+                    self.last_latency = time.time() - job["queued_at"]
+        self.status_changed.emit()
+
+
+def print_job(order):
+    # Everything a receipt needs, copied so the worker never touches the Order
+    return {"order_number": order.order_number, "bar_items": order.bar_items, "food_items": order.food_items,
+            "drink_items": order.drink_items, "queued_at": time.time()}
+
+
+def receipt_for_job(job):
+    receipt = Receipt()
+    if job["bar_items"]:
+        receipt.text('Bari joogid:', size=2)
+        for item, count in job["bar_items"].items():
+            receipt.text(f"{item} x{count}")
+            receipt.feed(9)
+
+    if job["food_items"]:
+        receipt.text('Sinu tellimus:', size=2)
+        for item, count in (job["food_items"] | job["drink_items"]).items():
+            receipt.text(f"{item} x{count}")
+        receipt.text('Tellimuse nr:', size=2)
+        receipt.order_number(f"{str(job['order_number']).zfill(3)}")
+        receipt.feed(9)
+    return receipt
 
 
 if __name__ == "__main__":
@@ -1,211 +1,325 @@
+import time
+START_TIME = time.perf_counter()  # Taken before the Qt imports so the startup report includes them
+
 import sys
-import socket
 import json
-from PyQt5.QtWidgets import QApplication, QWidget, QVBoxLayout, QHBoxLayout, QLabel, QFrame, QSplitter, QScrollArea
-from PyQt5.QtCore import Qt, QTimer, QSize
-from PyQt5.QtGui import QFont, QImage, QPainter, QColor
+from PyQt5.QtWidgets import QApplication, QWidget
+from PyQt5.QtCore import Qt, QTimer, QRect
+from PyQt5.QtGui import QFont, QImage, QPainter, QColor, QPixmap
+from PyQt5.QtNetwork import QTcpServer, QHostAddress
 import os
 import signal
+from collections import OrderedDict
+from protocol import (FrameDecoder, encode_message, resync_message, ack_message, board_from_snapshot,
+                      apply_changes, PROTOCOL_VERSION)
 
 os.environ['DISPLAY'] = ':0'
 
+BACKGROUND_PATH = "Tellimuse_ekraani_taust.jpg"  # Make sure this file exists in the same directory
+BACKGROUND_CACHE_DIR = "background_cache"
+
+
+class GlyphCache:
+    # Rendered text pixmaps, least recently used dropped first
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.pixmaps = OrderedDict()
+
+    def get(self, text, size, font, color):
+        key = (text, size.width(), size.height(), font.pointSizeF(), font.bold(), color)
+        pixmap = self.pixmaps.get(key)
+        if pixmap is not None:
+            self.pixmaps.move_to_end(key)
+            return pixmap
+
+        pixmap = QPixmap(size)
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
+        painter.setFont(font)
+        painter.setPen(QColor(color))
+        painter.drawText(pixmap.rect(), Qt.AlignCenter, text)
+        painter.end()
+
+        self.pixmaps[key] = pixmap
+        if len(self.pixmaps) > self.capacity:
+            self.pixmaps.popitem(last=False)
+        return pixmap
+
 
 class CustomerDisplay(QWidget):
+    # Board geometry in pixels: a header over a grid of number cells on each half.
+    # Cells shrink from max_cell_height as the queue grows, below min_cell_height
+    # the numbers are split into pages that rotate every page_interval ms.
+    header_height = 200
+    max_cell_height = 160
+    min_cell_height = 90
+    spacing = 10
+    min_columns = 3
+    max_columns = 5
+    page_interval = 5000
+    headers = ("Küpseb", "Valmis")
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Customer View")
-        self.background = None
-        self.scaled_background = None
-        self.load_background()
+        self.background = QPixmap()
+        self.background_source = None
+        self.first_frame_ms = None
+        self.setAttribute(Qt.WA_OpaquePaintEvent)  # paintEvent covers everything, skip Qt's background erase
+        self.load_background(QApplication.primaryScreen().size())
         self.active_orders = []
         self.completed_orders = []
-        self.init_ui()
-        self.server_socket = None
+        self.board = {}
+        self.cells = {}  # (side, index) -> order number currently drawn there
+        self.glyphs = GlyphCache()
+        self.number_font = QFont("Bebas neue", 100)
+        self.header_font = QFont("Bebas neue", 150, QFont.Bold)
+        self.page_font = QFont("Bebas neue", 40)
+        self.grids = [None, None]  # (columns, rows, cell width, cell height) per side
+        self.pages = [0, 0]
+        self.page_counts = [1, 1]
+        self.page_timer = QTimer(self)
+        self.page_timer.timeout.connect(self.rotate_pages)
+        self.page_timer.start(self.page_interval)
+        self.server = None
+        self.clients = {}
         self.start_server()
         self.setCursor(Qt.BlankCursor)
         self.showFullScreen()
 
-    def load_background(self):
-        background_path = "Tellimuse_ekraani_taust.jpg"  # Make sure this file exists in the same directory
-        self.background = QImage(background_path)
-        if self.background.isNull():
-            print(f"Failed to load background image: {background_path}")
-
-    def init_ui(self):
-        main_layout = QHBoxLayout(self)
-        main_layout.setContentsMargins(0, 0, 0, 0)
-        main_layout.setSpacing(0)
-
-        # Create splitter
-        self.splitter = QSplitter(Qt.Horizontal)
-        self.splitter.setStyleSheet("QSplitter::handle { background-color: rgba(50, 50, 50, 50); }")
-        main_layout.addWidget(self.splitter)
-
-        # Create active orders widget
-        self.active_widget = QWidget()
-        self.active_widget.setAttribute(Qt.WA_TranslucentBackground)
-        self.active_layout = QVBoxLayout(self.active_widget)
-        self.active_layout.setAlignment(Qt.AlignTop)
-        self.active_layout.setSpacing(10)
-        self.splitter.addWidget(self.active_widget)
-
-        # Create completed orders widget
-        self.completed_widget = QWidget()
-        self.completed_widget.setAttribute(Qt.WA_TranslucentBackground)
-        self.completed_layout = QVBoxLayout(self.completed_widget)
-        self.completed_layout.setAlignment(Qt.AlignTop)
-        self.completed_layout.setSpacing(10)
-        self.splitter.addWidget(self.completed_widget)
-
-        # Set initial sizes
-        self.splitter.setSizes([self.width() // 2, self.width() // 2])
-
-        # Create header labels
-        self.active_header = self.create_header_label("Küpseb")
-        self.completed_header = self.create_header_label("Valmis")
-
-        # Add headers to layouts
-        self.active_layout.addWidget(self.active_header)
-        self.completed_layout.addWidget(self.completed_header)
-
-        # Create scroll areas for orders
-        self.active_scroll = self.create_scroll_area()
-        self.completed_scroll = self.create_scroll_area()
-
-        self.active_layout.addWidget(self.active_scroll)
-        self.completed_layout.addWidget(self.completed_scroll)
-
-    def create_header_label(self, text):
-        label = QLabel(text)
-        label.setFont(QFont("Bebas neue", 150, QFont.Bold))
-        label.setAlignment(Qt.AlignCenter)
-        label.setStyleSheet("color: white; background-color: rgba(0, 0, 0, 100); border-radius: 10px; padding: 5px;")
-        label.setFixedHeight(200)
-        return label
+    def load_background(self, size):
+        # The JPEG is decoded and scaled once per screen size, later starts load an uncompressed BMP at screen size
+        cache_path = os.path.join(BACKGROUND_CACHE_DIR, f"background_{size.width()}x{size.height()}.bmp")
+        try:
+            cache_fresh = os.path.getmtime(cache_path) >= os.path.getmtime(BACKGROUND_PATH)
+        except OSError:
+            cache_fresh = False
+
+        if cache_fresh:
+            self.background = QPixmap(cache_path)
+            if not self.background.isNull():
+                self.background_source = "cache"
+                return
+
+        image = QImage(BACKGROUND_PATH)
+        if image.isNull():
+            print(f"Failed to load background image: {BACKGROUND_PATH}")
+            self.background = QPixmap()
+            return
+
+        image = image.scaled(size, Qt.KeepAspectRatioByExpanding, Qt.SmoothTransformation)
+        image = image.copy((image.width() - size.width()) // 2, (image.height() - size.height()) // 2,
+                           size.width(), size.height())
+        os.makedirs(BACKGROUND_CACHE_DIR, exist_ok=True)
+        if not image.save(cache_path):
+            print(f"Could not write background cache: {cache_path}")
+        self.background = QPixmap.fromImage(image)
+        self.background_source = "JPEG"
+
+    def resizeEvent(self, event):
+        if not self.background.isNull() and self.background.size() != self.size():
+            self.load_background(self.size())
+        self.update_display()
+
+    def board_rect(self, side):
+        half = self.width() // 2
+        return QRect(side * half, 0, half, self.height())
+
+    def header_rect(self, side):
+        board = self.board_rect(side)
+        return QRect(board.x() + self.spacing, self.spacing, board.width() - 2 * self.spacing, self.header_height)
+
+    def grid_for(self, count, board):
+        # The column count that gives the tallest cells, fewer columns on a tie
+        available = board.height() - self.header_height - 3 * self.spacing
+        best = None
+        for columns in range(self.min_columns, self.max_columns + 1):
+            rows = max(1, -(-count // columns))
+            width = (board.width() - (columns + 1) * self.spacing) // columns
+            height = min(self.max_cell_height, (available - (rows - 1) * self.spacing) // rows)
+            if best is None or height > best[3]:
+                best = (columns, rows, width, height)
+
+        if best[3] < self.min_cell_height:
+            columns = self.max_columns
+            rows = max(1, (available + self.spacing) // (self.min_cell_height + self.spacing))
+            width = (board.width() - (columns + 1) * self.spacing) // columns
+            height = min(self.max_cell_height, (available - (rows - 1) * self.spacing) // rows)
+            best = (columns, rows, width, height)
+        return best
+
+    def cell_rect(self, side, index):
+        # Cells fill each column top to bottom before moving to the next one
+        board = self.board_rect(side)
+        _, rows, width, height = self.grids[side]
+        column, row = divmod(index, rows)
+        x = board.x() + self.spacing + column * (width + self.spacing)
+        y = self.header_height + 2 * self.spacing + row * (height + self.spacing)
+        return QRect(x, y, width, height)
+
+    def number_font_for(self, side):
+        # Scaled down from the 100 pt used in a full size cell, keeping three digits inside the cell width
+        _, _, width, height = self.grids[side]
+        font = QFont(self.number_font)
+        font.setPointSizeF(self.number_font.pointSizeF() * min(height / self.max_cell_height, width / 280))
+        return font
 
     def paintEvent(self, event):
+        start = time.perf_counter()
+        exposed = event.rect()
         painter = QPainter(self)
         if not self.background.isNull():
-            if self.scaled_background is None or self.scaled_background.size() != self.size():
-                self.scale_background()
-            painter.drawImage(self.rect(), self.scaled_background)
+            # The pixmap is already at widget size, copy just the exposed part
+            painter.drawPixmap(exposed, self.background, exposed)
         else:
-            painter.fillRect(self.rect(), QColor(200, 200, 200))  # Light gray background
-
-    def create_scroll_area(self):
-        scroll = QScrollArea()
-        scroll.setWidgetResizable(True)
-        scroll.setStyleSheet("QScrollArea { background: transparent; border: none; }")
-        scroll_content = QWidget()
-        scroll_content.setStyleSheet("background: transparent;")
-        scroll_layout = QVBoxLayout(scroll_content)
-        scroll_layout.setAlignment(Qt.AlignTop)
-        scroll_layout.setSpacing(5)
-        scroll.setWidget(scroll_content)
-        return scroll
-
-    def scale_background(self):
-        if not self.background.isNull():
-            self.scaled_background = self.background.scaled(
-                self.size(),
-                Qt.KeepAspectRatioByExpanding,
-                Qt.SmoothTransformation
-            )
+            painter.fillRect(exposed, QColor(200, 200, 200))  # Light gray background
+
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(Qt.NoPen)
+        painter.setBrush(QColor(0, 0, 0, 100))
+        for side, text in enumerate(self.headers):
+            rect = self.header_rect(side)
+            if rect.intersects(exposed):
+                painter.drawRoundedRect(rect, 10, 10)
+                painter.drawPixmap(rect.topLeft(), self.glyphs.get(text, rect.size(), self.header_font, Qt.white))
+                if self.page_counts[side] > 1:
+                    page_rect = self.page_rect(side)
+                    painter.drawPixmap(page_rect.topLeft(),
+                                       self.glyphs.get(f"{self.pages[side] + 1}/{self.page_counts[side]}",
+                                                       page_rect.size(), self.page_font, Qt.white))
+
+        painter.setBrush(QColor(255, 255, 255, 200))
+        fonts = [self.number_font_for(side) if self.grids[side] else None for side in range(2)]
+        for (side, index), number in self.cells.items():
+            rect = self.cell_rect(side, index)
+            if rect.intersects(exposed):
+                painter.drawRoundedRect(rect, 10, 10)
+                painter.drawPixmap(rect.topLeft(),
+                                   self.glyphs.get(str(number).zfill(3), rect.size(), fonts[side], Qt.black))
+        painter.end()
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        if self.first_frame_ms is None:
+            self.first_frame_ms = (time.perf_counter() - START_TIME) * 1000
+            print(f"First frame {self.first_frame_ms:.0f} ms after start (background from {self.background_source}, "
+                  f"paint {elapsed_ms:.1f} ms)")
+        elif exposed != self.rect() and elapsed_ms > 5:
+            print(f"Partial repaint of {exposed.width()}x{exposed.height()} took {elapsed_ms:.1f} ms")
+
+    def page_rect(self, side):
+        header = self.header_rect(side)
+        return QRect(header.right() - 130, header.bottom() - 70, 120, 60)
+
+    def rotate_pages(self):
+        if max(self.page_counts) > 1:
+            for side in range(2):
+                self.pages[side] += 1
+            self.update_display()
 
     def update_display(self):
-        self.update_orders(self.active_scroll, self.active_orders)
-        self.update_orders(self.completed_scroll, self.completed_orders)
-
-    def update_orders(self, scroll_area, numbers):
-        scroll_content = scroll_area.widget()
-        layout = scroll_content.layout()
-
-        self.clear_layout(layout)
-
-        h_layout = QHBoxLayout()
-        layout.addLayout(h_layout)
-
-        left_column = QVBoxLayout()
-        middle_column = QVBoxLayout()
-        right_column = QVBoxLayout()
-        h_layout.addLayout(left_column)
-        h_layout.addLayout(middle_column)
-        h_layout.addLayout(right_column)
-
-        for i, number in enumerate(numbers):
-            order_widget = self.create_order_widget(number)
-            if i < 5:
-                left_column.addWidget(order_widget)
-            elif i < 10:
-                middle_column.addWidget(order_widget)
-            elif i < 15:
-                right_column.addWidget(order_widget)
-
-        left_column.addStretch(1)
-        middle_column.addStretch(1)
-        right_column.addStretch(1)
-
-    def create_order_widget(self, order_number):
-        order_widget = QFrame()
-        order_widget.setStyleSheet("background-color: rgba(255, 255, 255, 200); border-radius: 10px; padding: 2px;")
-        order_layout = QVBoxLayout(order_widget)
-        order_layout.setContentsMargins(10, 10, 10, 10)
-        order_label = QLabel(f"{str(order_number).zfill(3)}")
-        order_label.setFont(QFont("Bebas neue", 100))
-        order_label.setAlignment(Qt.AlignCenter)
-        order_layout.addWidget(order_label)
-        order_widget.setFixedHeight(160)  # Set a fixed height for consistency
-        return order_widget
-
-    def clear_layout(self, layout):
-        if layout is not None:
-            while layout.count():
-                item = layout.takeAt(0)
-                widget = item.widget()
-                if widget is not None:
-                    widget.setParent(None)
-                    widget.deleteLater()
-                else:
-                    self.clear_layout(item.layout())
+        cells = {}
+        for side, numbers in enumerate((self.active_orders, self.completed_orders)):
+            board = self.board_rect(side)
+            grid = self.grid_for(len(numbers), board)
+            if grid != self.grids[side]:
+                # New cell geometry, the whole side is laid out again
+                self.grids[side] = grid
+                self.update(board)
+
+            page_size = grid[0] * grid[1]
+            page_count = max(1, -(-len(numbers) // page_size))
+            page = self.pages[side] % page_count
+            if (page, page_count) != (self.pages[side], self.page_counts[side]):
+                self.update(self.page_rect(side))
+            self.pages[side] = page
+            self.page_counts[side] = page_count
+
+            for index, number in enumerate(numbers[page * page_size:(page + 1) * page_size]):
+                cells[(side, index)] = number
+
+        # Only cells whose number changed are repainted
+        changed = [key for key in cells.keys() | self.cells.keys() if cells.get(key) != self.cells.get(key)]
+        self.cells = cells
+        for side, index in changed:
+            self.update(self.cell_rect(side, index))
 
     def start_server(self):
-        self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-        self.server_socket.bind(('0.0.0.0', 5000))  # Listen on all available interfaces
-        self.server_socket.listen(1)
-        self.server_socket.setblocking(False)
-
-        # Use QTimer to periodically check for incoming connections
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.check_for_connection)
-        self.timer.start(100)  # Check every 100 ms
-
-    def check_for_connection(self):
+        # Connections are handled as soon as Qt reports them, any number at a time
+        self.server = QTcpServer(self)
+        self.server.newConnection.connect(self.accept_connections)
+        if not self.server.listen(QHostAddress.Any, 5000):  # Listen on all available interfaces
+            print(f"Could not listen on port 5000: {self.server.errorString()}")
+
+    def accept_connections(self):
+        while self.server.hasPendingConnections():
+            client = self.server.nextPendingConnection()
+            self.clients[client] = {"decoder": FrameDecoder(), "seq": None, "resync_requested": False}
+            client.readyRead.connect(lambda client=client: self.read_client(client))
+            client.disconnected.connect(lambda client=client: self.drop_client(client))
+
+    def read_client(self, client):
+        state = self.clients.get(client)
+        if state is None:
+            return
+        try:
+            frames = state["decoder"].feed(bytes(client.readAll()))
+        except ValueError as e:
+            print(f"Dropping client {client.peerAddress().toString()}: {e}")
+            client.abort()
+            return
+
+        for frame in frames:
+            self.handle_frame(client, frame)
+
+    def handle_frame(self, client, frame):
         try:
-            client_socket, address = self.server_socket.accept()
-            data = client_socket.recv(1024)
-
-            if data == b'ping':
-                client_socket.sendall(b'pong')
-            else:
-                try:
-                    orders_data = json.loads(data.decode())
-                    self.active_orders = orders_data['active_orders']
-                    self.completed_orders = orders_data['completed_orders']
-                    self.update_display()
-                except json.JSONDecodeError:
-                    print(f"Received invalid JSON data: {data}")
-
-            client_socket.close()
-        except BlockingIOError:
-            pass  # No incoming connection, just continue
-        except Exception as e:
-            print(f"Error in check_for_connection: {e}")
+            message = json.loads(frame.decode())
+            if message.get("v") != PROTOCOL_VERSION:
+                print(f"Ignoring message with unsupported protocol version: {message.get('v')}")
+                return
+            self.handle_message(client, message)
+        except (json.JSONDecodeError, UnicodeDecodeError, KeyError, TypeError, ValueError):
+            print(f"Received invalid order data: {frame[:200]}")
+
+    def handle_message(self, client, message):
+        state = self.clients[client]
+        kind = message["type"]
+        if kind == "snapshot":
+            self.board = board_from_snapshot(message)
+            state["seq"] = message["seq"]
+            state["resync_requested"] = False
+        elif kind == "delta":
+            if state["seq"] is None or message["seq"] != state["seq"] + 1:
+                # A missed delta means the board is stale, ask once for a fresh snapshot
+                if not state["resync_requested"]:
+                    print(f"Sequence gap: expected {None if state['seq'] is None else state['seq'] + 1}, "
+                          f"got {message['seq']}. Requesting resync.")
+                    client.write(encode_message(resync_message(state["seq"])))
+                    state["resync_requested"] = True
+                state["seq"] = None
+                return
+            apply_changes(self.board, message["changes"])
+            state["seq"] = message["seq"]
+        elif kind != "heartbeat":
+            return
+
+        client.write(encode_message(ack_message(state["seq"], message.get("t"))))
+        if kind == "heartbeat":
+            return
+
+        self.active_orders = sorted(number for number, status in self.board.items() if status == "active")
+        self.completed_orders = sorted(number for number, status in self.board.items() if status == "completed")
+        self.update_display()
+
+    def drop_client(self, client):
+        self.clients.pop(client, None)
+        client.deleteLater()
 
     def cleanup(self):
         print("Cleaning up...")
-        if self.server_socket:
-            self.server_socket.close()
+        if self.server:
+            self.server.close()
         self.close()
         QApplication.quit()
 
@@ -0,0 +1,271 @@
+import json
+import os
+import sqlite3
+
+JOURNAL_PATH = "orders_journal.jsonl"
+SQLITE_PATH = "orders.db"
+
+
+def apply_record(orders, record):
+    # orders is a dict of order_number -> order record, in creation order
+    op = record.get("op")
+    if op == "create":
+        order = record["order"]
+        orders[order["order_number"]] = order
+    elif op == "update":
+        order = orders.get(record["order_number"])
+        if order is not None:
+            order.update(record["fields"])
+    elif op == "delete":
+        orders.pop(record["order_number"], None)
+
+
+def is_open_on(order, day):
+    return order["creation_time"] >= day and order["status"] != "picked up"
+
+
+class OrderStore:
+    # Interface of the storage backends, orders cross it as plain records (Order.to_record())
+
+    def exists(self):
+        raise NotImplementedError
+
+    def load_orders(self):
+        raise NotImplementedError
+
+    def load_open_orders(self, day):
+        # Orders created on day (a 'YYYY-MM-DD' string) that are not picked up yet
+        raise NotImplementedError
+
+    def history_records(self, day):
+        # Every other order, as an iterator that may be consumed on another thread
+        raise NotImplementedError
+
+    def max_order_number(self):
+        raise NotImplementedError
+
+    def import_orders(self, orders):
+        for order in orders:
+            self.create_order(order)
+
+    def create_order(self, order):
+        raise NotImplementedError
+
+    def update_order(self, order_number, fields):
+        raise NotImplementedError
+
+    def delete_order(self, order_number):
+        raise NotImplementedError
+
+    def orders_with_status(self, status):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class OrderJournal(OrderStore):
+    # Append-only log of order mutations, one fsync'd JSON record per line
+
+    def __init__(self, path=JOURNAL_PATH):
+        self.path = path
+        self.file = None
+        self.record_count = 0
+        self.orders = {}
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def replay(self):
+        orders = {}
+        self.record_count = 0
+        if not self.exists():
+            return orders
+
+        with open(self.path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # A torn last line is expected after a crash mid-write
+                    print(f"Skipping unreadable journal record on line {line_number}")
+                    continue
+                apply_record(orders, record)
+                self.record_count += 1
+
+        return orders
+
+    def load_orders(self):
+        self.orders = self.replay()
+        # Drop superseded records once they clearly outnumber the live orders
+        if self.record_count > 2 * len(self.orders) + 100:
+            self.compact(list(self.orders.values()))
+        return [dict(order) for order in self.orders.values()]
+
+    def load_open_orders(self, day):
+        self.load_orders()
+        return [dict(order) for order in self.orders.values() if is_open_on(order, day)]
+
+    def history_records(self, day):
+        # Copied now, the journal keeps changing on the GUI thread
+        return iter([dict(order) for order in self.orders.values() if not is_open_on(order, day)])
+
+    def max_order_number(self):
+        return max(self.orders, default=0)
+
+    def append(self, record):
+        self.append_many([record])
+
+    def append_many(self, records):
+        # One fsync covers the whole batch
+        if self.file is None:
+            self.file = open(self.path, "a", encoding="utf-8")
+        for record in records:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            apply_record(self.orders, record)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.record_count += len(records)
+
+    def import_orders(self, orders):
+        self.append_many([{"op": "create", "order": dict(order)} for order in orders])
+
+    def create_order(self, order):
+        self.append({"op": "create", "order": dict(order)})
+
+    def update_order(self, order_number, fields):
+        self.append({"op": "update", "order_number": order_number, "fields": dict(fields)})
+
+    def delete_order(self, order_number):
+        self.append({"op": "delete", "order_number": order_number})
+
+    def orders_with_status(self, status):
+        return [dict(order) for order in self.orders.values() if order["status"] == status]
+
+    def compact(self, orders):
+        # Rewrite the journal as one create record per live order
+        self.close()
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            for order in orders:
+                f.write(json.dumps({"op": "create", "order": order}, ensure_ascii=False) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self.record_count = len(orders)
+        self.orders = {order["order_number"]: dict(order) for order in orders}
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class SQLiteOrderStore(OrderStore):
+    # Orders in one SQLite table, one transaction per mutation
+
+    # Item dicts and total_cost (a number, 'free' or 'coupon') are stored as JSON
+    json_columns = ("food_items", "drink_items", "bar_items", "total_cost")
+    columns = ("order_number", "creation_time", "customer_name", "food_items", "drink_items",
+               "bar_items", "total_cost", "status", "card_or_cash")
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self.existed = os.path.exists(path)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.execute("""
+                CREATE TABLE IF NOT EXISTS orders (
+                    order_number INTEGER PRIMARY KEY,
+                    creation_time TEXT NOT NULL,
+                    customer_name TEXT,
+                    food_items TEXT NOT NULL,
+                    drink_items TEXT NOT NULL,
+                    bar_items TEXT NOT NULL,
+                    total_cost TEXT,
+                    status TEXT NOT NULL,
+                    card_or_cash TEXT
+                )
+            """)
+            self.connection.execute("CREATE INDEX IF NOT EXISTS orders_status ON orders (status)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS orders_creation_time ON orders (creation_time)")
+
+    def exists(self):
+        return self.existed
+
+    def to_row(self, order):
+        return tuple(json.dumps(order[column], ensure_ascii=False) if column in self.json_columns
+                     else order[column] for column in self.columns)
+
+    def from_row(self, row):
+        return {column: json.loads(value) if column in self.json_columns else value
+                for column, value in zip(self.columns, row)}
+
+    def select(self, where="", parameters=()):
+        cursor = self.connection.execute(
+            f"SELECT {', '.join(self.columns)} FROM orders {where} ORDER BY order_number", parameters)
+        return [self.from_row(row) for row in cursor]
+
+    def load_orders(self):
+        return self.select()
+
+    def load_open_orders(self, day):
+        return self.select("WHERE creation_time >= ? AND status != 'picked up'", (day,))
+
+    def history_records(self, day, batch_size=2000):
+        # Runs on the loader thread, which needs a connection of its own
+        connection = sqlite3.connect(self.path)
+        try:
+            cursor = connection.execute(
+                f"SELECT {', '.join(self.columns)} FROM orders "
+                f"WHERE creation_time < ? OR status = 'picked up' ORDER BY order_number", (day,))
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield self.from_row(row)
+        finally:
+            connection.close()
+
+    def max_order_number(self):
+        return self.connection.execute("SELECT MAX(order_number) FROM orders").fetchone()[0] or 0
+
+    def import_orders(self, orders):
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO orders VALUES ({', '.join('?' * len(self.columns))})",
+                [self.to_row(order) for order in orders])
+
+    def create_order(self, order):
+        self.import_orders([order])
+
+    def update_order(self, order_number, fields):
+        assignments = ", ".join(f"{column} = ?" for column in fields)
+        values = [json.dumps(value, ensure_ascii=False) if column in self.json_columns else value
+                  for column, value in fields.items()]
+        with self.connection:
+            self.connection.execute(f"UPDATE orders SET {assignments} WHERE order_number = ?",
+                                    values + [order_number])
+
+    def delete_order(self, order_number):
+        with self.connection:
+            self.connection.execute("DELETE FROM orders WHERE order_number = ?", (order_number,))
+
+    def orders_with_status(self, status):
+        return self.select("WHERE status = ?", (status,))
+
+    def close(self):
+        self.connection.close()
+
+
+def open_order_store(backend):
+    if backend == "sqlite":
+        return SQLiteOrderStore()
+    elif backend == "journal":
+        return OrderJournal()
+    raise ValueError(f"Unknown storage backend: {backend}")